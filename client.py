@@ -4,28 +4,41 @@ import asyncio
 import json
 import pprint
 import sys
+import time
 import traceback
 import logging
 from pprint import pformat
-from typing import List, Any, AsyncGenerator, Dict, Coroutine, TypeVar
+from typing import List, Any, AsyncGenerator, Dict, Coroutine, TypeVar, Tuple
 from typing import Optional
 
 from aiohttp import web
 from slackclient import SlackClient
 
 import hooks
+import recorder
 import settings
 import slack_util
 
 """
 Objects to wrap slack connections
 """
+# How long to wait before restarting a crashed passive. Doubles with each consecutive crash, up to the cap
+PASSIVE_RESTART_BASE_SECONDS = 1.0
+PASSIVE_RESTART_CAP_SECONDS = 300.0
+
+# If a passive stays up this long before crashing, it's had a fresh crash rather than another of the same
+PASSIVE_HEALTHY_SECONDS = 600.0
+
 # Read the API token
 
 
-api_file = open("apitoken.txt", 'r')
-SLACK_API = next(api_file).strip()
-api_file.close()
+# Where to find the slack api token
+API_TOKEN_FILE = "apitoken.txt"
+
+
+def _read_api_token() -> str:
+    with open(API_TOKEN_FILE, 'r') as api_file:
+        return next(api_file).strip()
 
 
 class ClientWrapper(object):
@@ -45,37 +58,88 @@ class ClientWrapper(object):
         # Periodicals are just wrappers around an iterable, basically
         self.passives: List[hooks.Passive] = []
 
+        # How many times each passive has been restarted after crashing
+        self.passive_restarts: Dict[hooks.Passive, int] = {}
+
         # Cache users and channels
         self.users: Dict[str, slack_util.User] = {}
         self.conversations: Dict[str, slack_util.Conversation] = {}
 
+        # Cache DM channel ids, by user id
+        self.dm_channels: Dict[str, str] = {}
+
     # Scheduled/passive events handling
     def add_passive(self, per: hooks.Passive) -> None:
         self.passives.append(per)
 
     async def run_passives(self) -> None:
         """
-        Run all currently added passives
+        Run all currently added passives, each in its own supervised task.
+        A crashing passive is restarted on its own, and never takes down the others (or event handling).
+        """
+        await asyncio.gather(*[self._supervise_passive(p) for p in self.passives])
+
+    async def _supervise_passive(self, passive: hooks.Passive) -> None:
+        """
+        Runs a passive, restarting it with exponential backoff whenever it crashes.
+        A passive that returns normally is done, and isn't restarted.
+        """
+        consecutive_crashes = 0
+        while True:
+            started = time.monotonic()
+            try:
+                await passive.run()
+                return
+            except Exception:
+                output = traceback.format_exc()
+
+            # Back off, unless it had been running fine for a while
+            if time.monotonic() - started >= PASSIVE_HEALTHY_SECONDS:
+                consecutive_crashes = 0
+            delay = min(PASSIVE_RESTART_CAP_SECONDS, PASSIVE_RESTART_BASE_SECONDS * 2 ** consecutive_crashes)
+            consecutive_crashes += 1
+            self.passive_restarts[passive] = self.passive_restarts.get(passive, 0) + 1
+
+            # Tell people
+            report = "Passive {} crashed (restart #{}). Restarting in {:.0f}s.\n{}".format(
+                type(passive).__name__,
+                self.passive_restarts[passive],
+                delay,
+                output)
+            logging.error(report)
+            try:
+                self.send_message(report, "#botzone")
+            except Exception:
+                logging.exception("Couldn't report passive crash")
+
+            await asyncio.sleep(delay)
+
+    def describe_passives(self) -> str:
+        """
+        Lists every passive, with how many times it has been restarted.
         """
-        awaitables = [p.run() for p in self.passives]
-        await asyncio.gather(*awaitables)
+        return "\n".join("{}: {} restarts".format(type(p).__name__, self.passive_restarts.get(p, 0))
+                         for p in self.passives)
 
     # Incoming slack hook handling
     def add_hook(self, hook: hooks.AbsHook) -> None:
         self.hooks.append(hook)
 
-    async def handle_events(self) -> None:
+    async def handle_events(self, recordings: Optional[List[str]] = None, speed: float = 1) -> None:
         """
         Asynchronous tasks that eternally reads and responds to messages.
+        If recordings are given, the events in them are handled instead of live ones, at the given speed up.
         """
         # Create a queue
         queue = asyncio.Queue()
 
-        # Create a task to put rtm events to the queue
-        rtm_task = asyncio.create_task(self.rtm_event_feed(queue))
-
-        # Create a task to put http events to the queue
-        http_task = asyncio.create_task(self.http_event_feed(queue))
+        if recordings is None:
+            # Create a task to put rtm events to the queue
+            feeds = [asyncio.create_task(self.rtm_event_feed(queue)),
+                     # Create a task to put http events to the queue
+                     asyncio.create_task(self.http_event_feed(queue))]
+        else:
+            feeds = [asyncio.create_task(recorder.replay_event_feed(queue, recordings, speed))]
 
         # Create a task to handle all other tasks
         async def handle_task_loop():
@@ -85,7 +149,7 @@ class ClientWrapper(object):
                     await t3
 
         # Handle them all
-        await asyncio.gather(rtm_task, http_task, handle_task_loop())
+        await asyncio.gather(*feeds, handle_task_loop())
 
     async def rtm_event_feed(self, msg_queue: asyncio.Queue) -> None:
         """
@@ -93,11 +157,13 @@ class ClientWrapper(object):
         Yields messages awaitably forever.
         """
         # Create the msg feed
-        feed = slack_util.message_stream(self.slack)
+        feed = slack_util.update_stream(self.slack)
 
-        # Create a simple callable that gets one message from the feed
+        # Create a simple callable that gets one message from the feed, recording it as it comes
         def get_one():
-            return next(feed)
+            update = next(feed)
+            recorder.record(recorder.RTM, update)
+            return slack_util.message_dict_to_event(update)
 
         # Continuously yield async threaded tasks that poll the feed
         while True:
@@ -114,30 +180,11 @@ class ClientWrapper(object):
                 logging.info("\nInteraction Event received:")
                 logging.debug(pformat(payload))
 
-                # Handle each action separately
-                if "actions" in payload:
-                    for action in payload["actions"]:
-                        # Start building the event
-                        ev = slack_util.Event()
-
-                        # Get the user who clicked the button
-                        ev.user = slack_util.UserContext(payload["user"]["id"])
-
-                        # Get the message that they clicked
-                        ev.message = slack_util.RelatedMessageContext(payload["message"]["ts"], payload["message"]["text"])
-
-                        # Get the channel it was clicked in
-                        ev.conversation = slack_util.ConversationContext(payload["channel"]["id"])
+                recorder.record(recorder.HTTP, payload)
 
-                        # Get the message this button/action was attached to
-                        ev.interaction = slack_util.InteractionContext(payload["response_url"],
-                                                                       payload["trigger_id"],
-                                                                       action["block_id"],
-                                                                       action["action_id"],
-                                                                       action.get("value"))
-
-                        # Put it in the queue
-                        await event_queue.put(ev)
+                # Handle each action separately
+                for ev in slack_util.interaction_payload_to_events(payload):
+                    await event_queue.put(ev)
 
                 # Respond that everything is fine
                 return web.Response(status=200)
@@ -295,6 +342,52 @@ class ClientWrapper(object):
         """
         return self._send_core("chat.postEphemeral", text, channel_id, thread, False, blocks)
 
+    def upload_snippet(self, content: str, title: str, channel_id: str, thread: str = None) -> dict:
+        """
+        Posts text as a snippet, which keeps its formatting and folds away if long.
+        Returns the JSON response.
+        """
+        kwargs = {"channels": channel_id, "content": content, "title": title, "filetype": "text"}
+        if thread:
+            kwargs["thread_ts"] = thread
+        return self.api_call("files.upload", **kwargs)
+
+    def open_dm(self, user_id: str) -> Optional[str]:
+        """
+        Gets the id of the DM channel with a user, opening it if necessary.
+        Returns None on failure.
+        """
+        channel_id = self.dm_channels.get(user_id)
+        if channel_id is None:
+            result = self.api_call("conversations.open", users=user_id)
+            if not result.get("ok"):
+                logging.warning("Failed to open DM with {}. Message: {}".format(user_id, result))
+                return None
+            channel_id = self.dm_channels[user_id] = result["channel"]["id"]
+        return channel_id
+
+    async def send_dms(self, messages: List[Tuple[str, str]]) -> List[bool]:
+        """
+        Sends each (user_id, text) as a DM, up to settings.DM_CONCURRENCY at a time.
+        Returns whether each message was successfully sent, in the same order.
+        """
+        limiter = asyncio.Semaphore(settings.DM_CONCURRENCY)
+
+        def send_one(user_id: str, text: str) -> bool:
+            channel_id = self.open_dm(user_id)
+            return channel_id is not None and bool(self.send_message(text, channel_id).get("ok"))
+
+        async def send_one_async(user_id: str, text: str) -> bool:
+            async with limiter:
+                try:
+                    return await asyncio.get_running_loop().run_in_executor(None, send_one, user_id, text)
+                except Exception:
+                    logging.exception("Failed to DM {}".format(user_id))
+                    return False
+
+        # Send them all
+        return list(await asyncio.gather(*[send_one_async(user_id, text) for user_id, text in messages]))
+
     def edit_message(self, text: Optional[str], channel_id: str, message_ts: str, blocks: Optional[List[dict]] = None):
         """
         Edits a message.
@@ -341,6 +434,7 @@ class ClientWrapper(object):
                     if channel_dict["is_im"]:
                         new_channel = slack_util.DirectMessage(id=channel_dict["id"],
                                                                user_id="@" + channel_dict["user"])
+                        self.dm_channels[channel_dict["user"]] = channel_dict["id"]
                     else:
                         new_channel = slack_util.Channel(id=channel_dict["id"],
                                                          name="#" + channel_dict["name"])
@@ -398,14 +492,25 @@ class ClientWrapper(object):
         self.users = new_dict
 
 
-# Create a single instance of the client wrapper
-_singleton = ClientWrapper(SLACK_API)
+# The single instance of the client wrapper. Created on first use, so that it can be swapped out beforehand
+_singleton: Optional[ClientWrapper] = None
 
 
 def get_slack() -> ClientWrapper:
+    global _singleton
+    if _singleton is None:
+        _singleton = ClientWrapper(_read_api_token())
     return _singleton
 
 
+def set_slack(wrapper: ClientWrapper) -> None:
+    """
+    Replaces the client wrapper everything uses. For testing against a fake slack.
+    """
+    global _singleton
+    _singleton = wrapper
+
+
 """
 Miscellania
 """
@@ -0,0 +1,337 @@
+"""
+Watches for the event loop being blocked (say, by a synchronous api call in a coroutine), and records where.
+
+A heartbeat coroutine ticks on the loop, measuring how late each tick is. Meanwhile a monitor thread checks that the
+heartbeat is still ticking. If it stops for too long, the loop is stuck in something, so the monitor grabs the loop
+thread's stack. Stalls are tallied per call site, so the worst offenders can be reported.
+
+Also has a sampling profiler, for finding out where the time goes over a short window, without a restart.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+import hooks
+
+# How often the heartbeat ticks, in seconds
+HEARTBEAT_INTERVAL = 0.1
+
+# How long the loop can go without a tick before it counts as blocked
+BLOCK_THRESHOLD = 0.25
+
+# How many recent lag measurements to keep, for percentiles
+LAG_HISTORY = 3000
+
+# How many frames of each stall's stack to keep
+STACK_DEPTH = 8
+
+# Our own code lives here. Call sites are attributed to the innermost frame in it, rather than library internals
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# How often the profiler samples the loop's stack, in seconds
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# How often the profiler checks what suspended tasks are waiting on, in seconds. Done on the loop, so less often
+PROFILE_AWAIT_INTERVAL = 0.05
+
+# Longest a profile can run for, in seconds
+PROFILE_MAX_SECONDS = 300
+
+# (file, line, function)
+CallSite = Tuple[str, int, str]
+
+
+@dataclass
+class StallStats(object):
+    """
+    Tallies stalls at one call site.
+    """
+    stack: List[str]  # Formatted stack of the most recent stall here
+    count: int = 0
+    total_seconds: float = 0
+    max_seconds: float = 0
+
+
+def _call_site(stack: List[traceback.FrameSummary]) -> CallSite:
+    """
+    Picks the frame to blame for a stack: the innermost one in our code, or failing that the innermost one.
+    """
+    ours = [f for f in stack if f.filename.startswith(BOT_DIR) and f.filename != __file__]
+    frame = (ours or stack)[-1]
+    return os.path.relpath(frame.filename, BOT_DIR), frame.lineno, frame.name
+
+
+class LoopWatchdog(hooks.Passive):
+    """
+    Measures event loop lag, and catches whatever is blocking it. Register as a passive to start watching.
+    """
+
+    def __init__(self, interval: float = HEARTBEAT_INTERVAL, threshold: float = BLOCK_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+
+        # Shared with the monitor thread. Only touch under the lock
+        self.lock = threading.Lock()
+        self.last_beat = time.monotonic()
+        self.loop_thread_id: Optional[int] = None
+        self.lags: Deque[float] = deque(maxlen=LAG_HISTORY)
+        self.max_lag = 0.0
+        self.stalls: Dict[CallSite, StallStats] = {}
+
+        # The call site blamed for the stall in progress, if any
+        self.current_stall: Optional[CallSite] = None
+
+        self.monitor: Optional[threading.Thread] = None
+
+    async def run(self) -> None:
+        with self.lock:
+            self.loop_thread_id = threading.get_ident()
+            self.last_beat = time.monotonic()
+
+        # The monitor outlives restarts of the heartbeat
+        if self.monitor is None:
+            self.monitor = threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True)
+            self.monitor.start()
+
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat(now, max(now - expected, 0))
+
+    def _beat(self, now: float, lag: float) -> None:
+        with self.lock:
+            self.last_beat = now
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+            # If the monitor caught a stall, now we know how long it was
+            if self.current_stall is not None:
+                stats = self.stalls[self.current_stall]
+                stats.total_seconds += lag
+                stats.max_seconds = max(stats.max_seconds, lag)
+                self.current_stall = None
+
+    def _monitor(self) -> None:
+        """
+        Runs in its own thread. Checks on the heartbeat, and grabs the loop's stack if it has stopped.
+        """
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if self.current_stall is not None or time.monotonic() - self.last_beat < self.threshold + self.interval:
+                    continue
+                frame = sys._current_frames().get(self.loop_thread_id)
+                beat = self.last_beat
+
+            if frame is None:
+                continue
+
+            # Work out who to blame without the lock. Formatting reads source files, and the loop may need the lock
+            # to beat the moment it unsticks
+            stack = traceback.extract_stack(frame)[-STACK_DEPTH:]
+            del frame
+            site = _call_site(stack)
+            formatted = traceback.format_list(stack)
+
+            with self.lock:
+                # If the loop beat in the meantime, the stall's already over, and it's too late to time it
+                if self.last_beat != beat or self.current_stall is not None:
+                    continue
+                stats = self.stalls.get(site)
+                if stats is None:
+                    stats = self.stalls[site] = StallStats(stack=[])
+                stats.stack = formatted
+                stats.count += 1
+                self.current_stall = site
+
+    def report(self, top: int = 5) -> str:
+        """
+        Summarises loop lag, and the worst call sites for blocking the loop.
+        """
+        with self.lock:
+            lags = sorted(self.lags)
+            stalls = sorted(self.stalls.items(), key=lambda kv: kv[1].total_seconds, reverse=True)
+            max_lag = self.max_lag
+
+        if not lags:
+            return "No loop lag measured yet"
+
+        lines = ["Loop lag over the last {} ticks: {:.1f}ms mean, {:.1f}ms p99, {:.1f}ms max ever".format(
+            len(lags),
+            sum(lags) / len(lags) * 1000,
+            lags[int(len(lags) * 0.99)] * 1000,
+            max_lag * 1000)]
+
+        if not stalls:
+            lines.append("No stalls over {:.0f}ms".format(self.threshold * 1000))
+        for (filename, lineno, function), stats in stalls[:top]:
+            lines.append("{}:{} in {}: {} stalls, {:.2f}s total, {:.0f}ms max".format(filename,
+                                                                                  lineno,
+                                                                                  function,
+                                                                                  stats.count,
+                                                                                  stats.total_seconds,
+                                                                                  stats.max_seconds * 1000))
+            lines.append("```{}```".format("".join(stats.stack[-3:])))
+        return "\n".join(lines)
+
+
+_global_watchdog = LoopWatchdog()
+
+
+def get_watchdog() -> LoopWatchdog:
+    return _global_watchdog
+
+
+def _code_key(frame) -> CallSite:
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(BOT_DIR):
+        filename = os.path.relpath(filename, BOT_DIR)
+    return filename, code.co_firstlineno, code.co_name
+
+
+def _is_handle_run(frame) -> bool:
+    """
+    Whether a frame is the loop running a callback or task step, as opposed to waiting for something to do.
+    """
+    return frame.f_code.co_name == "_run" and frame.f_code.co_filename.endswith(os.path.join("asyncio", "events.py"))
+
+
+class SamplingProfiler(object):
+    """
+    Profiles the event loop by sampling, so it is cheap enough to run on the live bot.
+
+    A thread samples the loop thread's stack. Each function on it gets a sample of cumulative time, and the innermost
+    one a sample of own time. Meanwhile a coroutine on the loop walks each suspended task's chain of awaits, and
+    counts a sample of await time for every coroutine in it. So await time is summed over tasks, and can exceed the
+    length of the profile.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL, await_interval: float = PROFILE_AWAIT_INTERVAL):
+        self.interval = interval
+        self.await_interval = await_interval
+
+        # Written by the sampling thread only, and read once it has stopped
+        self.samples = 0
+        self.busy_samples = 0
+        self.cumulative: Counter = Counter()
+        self.own: Counter = Counter()
+
+        # Written on the loop only
+        self.await_samples = 0
+        self.awaiting: Counter = Counter()
+
+        self.stopped = threading.Event()
+        self.elapsed = 0.0
+
+    def _sample_loop_thread(self, loop_thread_id: int) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(loop_thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.own[_code_key(frame)] += 1
+
+            # Count each function once per sample, however many times it recurses
+            seen: Set[CallSite] = set()
+            busy = False
+            while frame is not None:
+                seen.add(_code_key(frame))
+                busy = busy or _is_handle_run(frame)
+                frame = frame.f_back
+            self.cumulative.update(seen)
+            if busy:
+                self.busy_samples += 1
+
+    def _sample_awaits(self) -> None:
+        self.await_samples += 1
+        current = asyncio.current_task()
+        for task in asyncio.all_tasks():
+            if task is current:
+                continue
+
+            # Walk down what the task is awaiting, coroutine by coroutine
+            seen: Set[CallSite] = set()
+            coro = task.get_coro()
+            while coro is not None:
+                frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+                if frame is not None:
+                    seen.add(_code_key(frame))
+                coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+            self.awaiting.update(seen)
+
+    async def run(self, seconds: float) -> None:
+        """
+        Profiles the running loop for the given number of seconds.
+        """
+        start = time.monotonic()
+        sampler = threading.Thread(target=self._sample_loop_thread,
+                                   args=(threading.get_ident(),),
+                                   name="loop-profiler",
+                                   daemon=True)
+        sampler.start()
+        try:
+            while time.monotonic() - start < seconds:
+                self._sample_awaits()
+                await asyncio.sleep(self.await_interval)
+        finally:
+            self.stopped.set()
+            self.elapsed = time.monotonic() - start
+            sampler.join()
+
+    def report(self, top: int = 25) -> str:
+        """
+        Lists the top functions by cumulative time on the loop, and by time spent awaiting.
+        """
+        if not self.samples:
+            return "No samples taken"
+
+        seconds_per_sample = self.elapsed / self.samples
+        lines = ["Profiled {:.1f}s. Loop busy {:.1f}% of the time ({} stack samples, {} await samples)".format(
+            self.elapsed, self.busy_samples / self.samples * 100, self.samples, self.await_samples)]
+
+        def site(key: CallSite) -> str:
+            return "{}:{}({})".format(*key)
+
+        lines += ["", "Top functions by cumulative time on the loop:",
+                  "{:>8} {:>6} {:>8}  {}".format("cum(s)", "cum%", "own(s)", "function")]
+        for key, count in self.cumulative.most_common(top):
+            lines.append("{:>8.2f} {:>6.1f} {:>8.2f}  {}".format(count * seconds_per_sample,
+                                                                   count / self.samples * 100,
+                                                                   self.own[key] * seconds_per_sample,
+                                                                   site(key)))
+
+        if self.await_samples:
+            seconds_per_await_sample = self.elapsed / self.await_samples
+            lines += ["", "Top functions by time spent awaiting, summed over tasks:",
+                      "{:>8} {:>8}  {}".format("await(s)", "tasks", "function")]
+            for key, count in self.awaiting.most_common(top):
+                lines.append("{:>8.2f} {:>8.1f}  {}".format(count * seconds_per_await_sample,
+                                                            count / self.await_samples,
+                                                            site(key)))
+        return "\n".join(lines)
+
+
+# Only one profile at a time. Two would just profile each other
+_profile_lock = asyncio.Lock()
+
+
+async def profile(seconds: float) -> Optional[str]:
+    """
+    Profiles the loop for the given number of seconds (up to PROFILE_MAX_SECONDS), returning the report.
+    Returns None if a profile is already running.
+    """
+    if _profile_lock.locked():
+        return None
+    async with _profile_lock:
+        profiler = SamplingProfiler()
+        await profiler.run(min(seconds, PROFILE_MAX_SECONDS))
+        return profiler.report()
@@ -3,8 +3,16 @@ Examples provided by google for using their api.
 Very slightly modified by me to easily just get credentials
 """
 
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, Tuple, List, Any, Callable, TypeVar
+
 from googleapiclient.discovery import build
-from httplib2 import Http
+from googleapiclient.errors import HttpError
+from httplib2 import Http, HttpLib2Error
 from oauth2client import file, client, tools
 
 # If modifying these scopes, delete your previously saved credentials
@@ -23,35 +31,200 @@ def _init_sheets_service():
     return service
 
 
-_global_sheet_service = _init_sheets_service()
+# Created on first use, so that importing doesn't need credentials (or can be given a fake)
+_global_sheet_service = None
+_service_lock = threading.Lock()
+
+
+def get_sheet_service():
+    global _global_sheet_service
+    with _service_lock:
+        if _global_sheet_service is None:
+            _global_sheet_service = _init_sheets_service()
+        return _global_sheet_service
+
+
+def set_sheet_service(service) -> None:
+    """
+    Replaces the sheets service used for every request. For testing against a fake sheet.
+    """
+    global _global_sheet_service
+    _global_sheet_service = service
+
+
+"""
+Resilience. Sheets allows about 60 requests per minute per user, and occasionally just falls over.
+"""
+
+# Requests allowed per rolling minute, split by reads and writes as google does
+READS_PER_MINUTE = 60
+WRITES_PER_MINUTE = 60
+
+# Retry/backoff tuning
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = 32.0
+
+# After this many consecutive failed calls, stop calling sheets for a while
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN_SECONDS = 60.0
+
+# HTTP statuses worth retrying
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class SheetsUnavailable(Exception):
+    """Throw when sheets is degraded, and there's nothing cached to fall back on."""
+    pass
+
+
+class _QuotaBudget(object):
+    """
+    Rolling one minute request budget. Blocks callers until a request fits.
+    """
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.sent = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                # Forget anything more than a minute old
+                now = time.monotonic()
+                while self.sent and now - self.sent[0] >= 60:
+                    self.sent.popleft()
+
+                # If there's room, take it
+                if len(self.sent) < self.per_minute:
+                    self.sent.append(now)
+                    return
+
+                wait = 60 - (now - self.sent[0])
+            logging.warning("Sheets quota budget exhausted. Waiting {:.1f}s".format(wait))
+            time.sleep(wait)
+
+
+class _CircuitBreaker(object):
+    """
+    Trips after too many consecutive failures, then fails fast until the cooldown passes.
+    After that, lets calls through again; one more failure re-opens it.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            return self.opened_at is None or time.monotonic() - self.opened_at >= self.cooldown
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logging.error("Sheets circuit breaker tripped after {} failures".format(self.failures))
+                self.opened_at = time.monotonic()
+
+
+_read_budget = _QuotaBudget(READS_PER_MINUTE)
+_write_budget = _QuotaBudget(WRITES_PER_MINUTE)
+_breaker = _CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN_SECONDS)
+
+# Last values read from each (spreadsheet, range), served while sheets is degraded. Only ever what the sheet itself
+# returned: what we wrote isn't necessarily what a read would give back
+_range_cache: Dict[Tuple[str, str], List[List[Any]]] = {}
+
+
+def _is_retryable(e: Exception) -> bool:
+    if isinstance(e, HttpError):
+        return e.resp.status in RETRYABLE_STATUSES
+    return isinstance(e, (HttpLib2Error, OSError))
+
+
+T = TypeVar("T")
+
+
+def _call_with_retry(budget: _QuotaBudget, request: Callable[[], T]) -> T:
+    """
+    Executes a request within the quota budget, retrying retryable errors with jittered exponential backoff.
+    :raises SheetsUnavailable: If the breaker is open
+    """
+    if not _breaker.allow():
+        raise SheetsUnavailable("Sheets is unavailable. Not retrying for a while.")
+
+    for attempt in range(MAX_ATTEMPTS):
+        budget.acquire()
+        try:
+            result = request()
+            _breaker.record_success()
+            return result
+        except Exception as e:
+            # Real failures go straight up
+            if not _is_retryable(e):
+                raise
+
+            # Give up if we're out of attempts
+            if attempt == MAX_ATTEMPTS - 1:
+                _breaker.record_failure()
+                raise
+
+            # Otherwise wait a random portion of an exponentially growing window
+            delay = random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+            logging.warning("Sheets request failed ({}). Retrying in {:.1f}s".format(e, delay))
+            time.sleep(delay)
 
 
 # range should be of format 'SHEET NAME!A1:Z9'
-def get_sheet_range(spreadsheet_id, sheet_range):
+def get_sheet_range(spreadsheet_id, sheet_range, allow_cached=True):
     """
-    Gets an array of the desired table
+    Gets an array of the desired table.
+    If sheets is degraded, serves the last value read, if there is one and allow_cached is set.
     """
-    result = _global_sheet_service.spreadsheets().values().get(spreadsheetId=spreadsheet_id,
-                                                               range=sheet_range).execute()
+    def request():
+        return get_sheet_service().spreadsheets().values().get(spreadsheetId=spreadsheet_id,
+                                                              range=sheet_range).execute()
+
+    cache_key = (spreadsheet_id, sheet_range)
+    try:
+        result = _call_with_retry(_read_budget, request)
+    except Exception as e:
+        if allow_cached and (isinstance(e, SheetsUnavailable) or _is_retryable(e)) and cache_key in _range_cache:
+            logging.warning("Serving cached {} while sheets is degraded".format(sheet_range))
+            return _range_cache[cache_key]
+        raise
+
     values = result.get('values', [])
-    if not values:
-        return []
-    else:
-        return values
+    _range_cache[cache_key] = values
+    return values
 
 
 def set_sheet_range(spreadsheet_id, sheet_range, values):
     """
     Set an array in the desired table
+    :raises SheetsUnavailable: If sheets is degraded
     """
     body = {
         "values": values
     }
-    result = _global_sheet_service.spreadsheets().values().update(spreadsheetId=spreadsheet_id,
+
+    def request():
+        return get_sheet_service().spreadsheets().values().update(spreadsheetId=spreadsheet_id,
                                                                   range=sheet_range,
                                                                   valueInputOption="RAW",
                                                                   body=body).execute()
-    return result
+
+    return _call_with_retry(_write_budget, request)
 
 
 def get_calendar_credentials():
@@ -0,0 +1,7 @@
+"""
+Tools for running the bot's timed jobs without real slack, sheets, or waiting on the wall clock.
+
+virtual_time has an event loop whose clock jumps straight to the next timer, fakes has in-process stand-ins for slack
+and sheets, and simulate ties them together into a command line simulation of the reminder cycle.
+replay benchmarks message handling, by pushing recorded or made up messages through the bot's hooks.
+"""
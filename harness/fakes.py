@@ -0,0 +1,98 @@
+"""
+In-process stand-ins for slack and google sheets, which count every call made to them.
+"""
+
+import copy
+from collections import Counter
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class FakeSlackClient(object):
+    """
+    Stands in for slackclient.SlackClient. Answers the web api methods the bot uses, well enough to keep it happy.
+    Put it in a ClientWrapper's slack field.
+    """
+
+    def __init__(self, users: List[Tuple[str, str]], channels: List[str]):
+        self.users = users  # (id, real name)
+        self.channels = channels  # Names, without the #
+        self.calls: Counter = Counter()  # Calls made, by api method
+        self.sent: List[dict] = []  # Arguments of every message sent
+        self.message_count = 0
+
+    def api_call(self, api_method: str, **kwargs) -> dict:
+        self.calls[api_method] += 1
+
+        if api_method in ("chat.postMessage", "chat.postEphemeral", "chat.update"):
+            self.message_count += 1
+            self.sent.append(kwargs)
+            return {"ok": True, "channel": kwargs.get("channel"), "ts": "{}.000000".format(self.message_count)}
+
+        elif api_method == "conversations.open":
+            return {"ok": True, "channel": {"id": "D" + kwargs["users"]}}
+
+        elif api_method == "conversations.list":
+            return {"ok": True,
+                    "channels": [{"id": "C{}".format(i), "name": name, "is_im": False}
+                                 for i, name in enumerate(self.channels)],
+                    "response_metadata": {"next_cursor": ""}}
+
+        elif api_method == "users.list":
+            return {"ok": True,
+                    "members": [{"id": user_id, "name": user_id.lower(), "real_name": name, "profile": {}}
+                                for user_id, name in self.users],
+                    "response_metadata": {"next_cursor": ""}}
+
+        return {"ok": False, "error": "unknown_method"}
+
+
+class _FakeRequest(object):
+    def __init__(self, execute: Callable[[], dict]):
+        self.execute = execute
+
+
+def _as_read(values: List[List[Any]]) -> List[List[Any]]:
+    """
+    Copies written values the way the sheets api would read them back, with trailing blank cells and rows left off.
+    """
+    rows = []
+    for row in values:
+        row = list(row)
+        while row and row[-1] == "":
+            row.pop()
+        rows.append(row)
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows
+
+
+class FakeSheetsService(object):
+    """
+    Stands in for the google sheets service, with each range kept in memory. Give it to google_api.set_sheet_service.
+    """
+
+    def __init__(self, ranges: Dict[str, List[List[Any]]]):
+        self.ranges = ranges
+        self.calls: Counter = Counter()  # Requests executed, by kind
+
+    # The real api is service.spreadsheets().values().get(...).execute(). We're all of those at once
+    def spreadsheets(self) -> "FakeSheetsService":
+        return self
+
+    def values(self) -> "FakeSheetsService":
+        return self
+
+    # noinspection PyPep8Naming,PyShadowingBuiltins
+    def get(self, spreadsheetId: str, range: str) -> _FakeRequest:
+        def execute() -> dict:
+            self.calls["get"] += 1
+            return {"values": copy.deepcopy(self.ranges.get(range, []))}
+        return _FakeRequest(execute)
+
+    # noinspection PyPep8Naming,PyShadowingBuiltins,PyUnusedLocal
+    def update(self, spreadsheetId: str, range: str, valueInputOption: str, body: dict) -> _FakeRequest:
+        def execute() -> dict:
+            self.calls["update"] += 1
+            self.ranges[range] = _as_read(body["values"])
+            return {"updatedRange": range}
+        return _FakeRequest(execute)
@@ -0,0 +1,333 @@
+"""
+Benchmarks message handling end to end: raw RTM message dicts go through message_dict_to_event, into
+ClientWrapper.spool_tasks, and out through the bot's real hooks, against fake slack and sheets.
+Reports events handled per second, time from an event arriving to the bot's first reply to it, and how much CPU each
+hook spends deciding whether to handle events and then handling them.
+
+Feed it recordings made by recorder.py, a file of messages with one JSON dict per line, or let it make up a mix of
+chatter and commands. Run from the bot's directory, so the family tree can be found:
+    python -m harness.replay --events 2000
+    python -m harness.replay --file messages.jsonl --rate 50
+    python -m harness.replay --recording recordings/events-*.jsonl.gz --speed 10
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import client
+import google_api
+import hooks
+import main as bot_main
+import recorder
+import slack_util
+from harness import fakes, simulate, virtual_time
+from plugins import house_store, identifier, scroll_util, slavestothemachine, towel_ledger
+
+CHANNELS = simulate.CHANNELS + ["slavestothemachine"]
+
+# Api methods that count as the bot replying
+REPLY_METHODS = {"chat.postMessage", "chat.postEphemeral", "chat.update", "files.upload"}
+
+# Which event the running code is handling, as an index into the replay. Set for the duration of each hook's callback
+_replaying: contextvars.ContextVar = contextvars.ContextVar("replaying", default=None)
+
+
+@dataclass
+class HookStats(object):
+    """
+    CPU spent by one hook, in seconds.
+    """
+    name: str
+    tries: int = 0
+    match_seconds: float = 0  # Spent in try_apply, on every event
+    handled: int = 0
+    handle_seconds: float = 0  # Spent running the callback, on events it handled
+
+
+@dataclass
+class ReplayReport(object):
+    events: int
+    wall_seconds: float
+    reply_seconds: List[float]  # Time to first reply, for each event that got one
+    hooks: List[HookStats]
+    slack_calls: Counter = field(default_factory=Counter)
+    sheets_calls: Counter = field(default_factory=Counter)
+
+
+class _TimedCoroutine(object):
+    """
+    Awaits a hook callback one step at a time, adding up the CPU used by each step.
+    Time spent suspended doesn't count, so concurrent callbacks don't get charged for each other.
+    """
+
+    def __init__(self, coro, stats: HookStats, event_index: int):
+        self.coro = coro
+        self.stats = stats
+        self.event_index = event_index
+
+    def __await__(self):
+        _replaying.set(self.event_index)
+        steps = self.coro.__await__()
+        value, error = None, None
+        while True:
+            start = time.thread_time()
+            try:
+                if error is not None:
+                    yielded = steps.throw(error)
+                else:
+                    yielded = steps.send(value)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self.stats.handle_seconds += time.thread_time() - start
+
+            try:
+                value, error = (yield yielded), None
+            except BaseException as e:
+                value, error = None, e
+
+
+class _TimedHook(hooks.AbsHook):
+    """
+    Wraps a hook to measure it. Behaves exactly as the wrapped hook otherwise.
+    """
+
+    def __init__(self, hook: hooks.AbsHook, event_indices: Dict[int, int]):
+        super().__init__(hook.consumes)
+        self.hook = hook
+        self.event_indices = event_indices
+        callback = getattr(hook, "callback", None)
+        self.stats = HookStats(getattr(callback, "__qualname__", type(hook).__name__))
+
+    def try_apply(self, event: slack_util.Event) -> Optional[hooks.MsgAction]:
+        start = time.thread_time()
+        try:
+            coro = self.hook.try_apply(event)
+        finally:
+            self.stats.tries += 1
+            self.stats.match_seconds += time.thread_time() - start
+        if coro is None:
+            return None
+        self.stats.handled += 1
+        return self._timed(coro, self.event_indices.get(id(event)))
+
+    async def _timed(self, coro, event_index: Optional[int]) -> Any:
+        return await _TimedCoroutine(coro, self.stats, event_index)
+
+
+class _ReplySlackClient(fakes.FakeSlackClient):
+    """
+    Fake slack that notes when the first reply to each replayed event was sent.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.first_reply: Dict[int, float] = {}
+
+    def api_call(self, api_method: str, **kwargs) -> dict:
+        event_index = _replaying.get()
+        if api_method in REPLY_METHODS and event_index is not None:
+            self.first_reply.setdefault(event_index, time.perf_counter())
+        return super().api_call(api_method, **kwargs)
+
+
+def synthetic_messages(count: int, brothers: List[scroll_util.Brother], seed: int = 0) -> Iterator[dict]:
+    """
+    Makes up a plausible day's worth of traffic: mostly chatter, with towel work and house job commands mixed in.
+    Channel ids match the order of CHANNELS, as FakeSlackClient gives them out.
+    """
+    rng = random.Random(seed)
+    channel_ids = {name: "C{}".format(i) for i, name in enumerate(CHANNELS)}
+    chatter = ["lol", "anyone got a charger", "who took my leftovers", "meeting at 8", "nice", "see you there",
+               "is the dryer broken again", "ok", "brb", "pizza's here"]
+
+    for i in range(count):
+        sender = rng.choice(brothers)
+        other = rng.choice(brothers)
+        kind = rng.random()
+        if kind < 0.6:
+            channel, text = rng.choice(["general", "random", "housejobs"]), rng.choice(chatter)
+        elif kind < 0.8:
+            channel = "slavestothemachine"
+            verbs = rng.sample(slavestothemachine.counted_data, rng.randint(1, 3))
+            text = " ".join("{} {}".format(verb, rng.randint(1, 20)) for verb in verbs)
+        elif kind < 0.88:
+            channel, text = "housejobs", "signoff {}".format(other.name)
+        elif kind < 0.92:
+            channel, text = "housejobs", "undo signoff {}".format(other.name)
+        elif kind < 0.95:
+            channel, text = "random", rng.choice(["what is my scroll", "what is my name", "point history"])
+        else:
+            channel, text = "random", rng.choice(["leaderboard", "towel stats washed", "scroll {}".format(
+                other.scroll)])
+        yield {"type": "message",
+               "channel": channel_ids[channel],
+               "user": "U{}".format(sender.scroll),
+               "text": text,
+               "ts": "{}.{:06d}".format(1500000000 + i, i)}
+
+
+def read_messages(path: str) -> List[dict]:
+    """
+    Reads RTM message dicts, one JSON object per line.
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def paced_events(messages: List[dict], rate: float) -> AsyncIterator[slack_util.Event]:
+    """
+    Yields the event for each message, rate per second, or all at once if rate is 0.
+    """
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        if rate:
+            await asyncio.sleep(max(start + i / rate - time.perf_counter(), 0))
+        yield slack_util.message_dict_to_event(message)
+
+
+async def replay(feed: AsyncIterator[slack_util.Event], brother_count: int, workdir: str) -> ReplayReport:
+    """
+    Pushes each event from the feed through the bot's hooks as it comes, and waits for every resulting task to finish.
+    """
+    # Everything that would block runs inline, so its CPU is charged to the hook that caused it
+    asyncio.get_running_loop().set_default_executor(virtual_time.InlineExecutor())
+
+    # Swap in the fakes, keeping all state in the work dir
+    house_store.DB_PATH = os.path.join(workdir, "house_store.sqlite")
+    identifier.DB_NAME = os.path.join(workdir, "user_scrolls.sqlite")
+    identifier.LEGACY_SHELVE_NAME = os.path.join(workdir, "user_scrolls")
+
+    sheets = simulate.make_house(brother_count)
+    google_api.set_sheet_service(sheets)
+
+    brothers = [b for b in scroll_util.all_brothers() if b.is_valid()][:brother_count]
+    slack = _ReplySlackClient([("U{}".format(b.scroll), b.name) for b in brothers], CHANNELS)
+    wrapper = client.ClientWrapper("fake-token")
+    wrapper.slack = slack
+    client.set_slack(wrapper)
+    wrapper.update_channels()
+    wrapper.update_users()
+
+    # Everyone is registered, and the lazily loaded state is warm, as it would be in a bot that's been up a while
+    for b in brothers:
+        await identifier._get_index().register("U{}".format(b.scroll), b.scroll)
+    await towel_ledger.get_ledger()
+
+    # Measure the real hooks
+    event_indices: Dict[int, int] = {}
+    bot_main.register_hooks(wrapper)
+    timed_hooks = [_TimedHook(hook, event_indices) for hook in wrapper.hooks]
+    wrapper.hooks = list(timed_hooks)
+    slack.calls.clear()
+    sheets.calls.clear()
+
+    # Spool events off the queue just as handle_events does, keeping track of what gets started
+    queue = asyncio.Queue()
+    tasks: List[asyncio.Task] = []
+
+    async def spool():
+        async for task in wrapper.spool_tasks(queue):
+            tasks.append(task)
+    spooler = asyncio.create_task(spool())
+
+    events = []
+    arrived: List[float] = []
+    start = time.perf_counter()
+    async for event in feed:
+        i = len(events)
+        events.append(event)
+        event_indices[id(event)] = i
+        arrived.append(time.perf_counter())
+        await queue.put(event)
+
+    # Wait for the queue to drain, then for everything it started. Which may start more
+    while not queue.empty():
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    while not all(t.done() for t in tasks):
+        await asyncio.gather(*tasks, return_exceptions=True)
+    wall_seconds = time.perf_counter() - start
+    spooler.cancel()
+
+    reply_seconds = [slack.first_reply[i] - arrived[i] for i in range(len(events)) if i in slack.first_reply]
+    return ReplayReport(len(events), wall_seconds, reply_seconds, [h.stats for h in timed_hooks],
+                        Counter(slack.calls), Counter(sheets.calls))
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def format_report(report: ReplayReport) -> str:
+    lines = ["{} events in {:.2f}s: {:.1f} events/s".format(report.events,
+                                                           report.wall_seconds,
+                                                           report.events / report.wall_seconds)]
+
+    replies = sorted(report.reply_seconds)
+    if replies:
+        lines.append("{} got replies. Time to reply: {:.1f}ms p50, {:.1f}ms p99, {:.1f}ms max".format(
+            len(replies), _percentile(replies, 0.5) * 1000, _percentile(replies, 0.99) * 1000, replies[-1] * 1000))
+    else:
+        lines.append("Nothing got a reply")
+
+    lines.append("Slack calls: {}. Sheets calls: {}".format(
+        ", ".join("{} {}".format(method, n) for method, n in report.slack_calls.most_common()) or "none",
+        ", ".join("{} {}".format(kind, n) for kind, n in report.sheets_calls.most_common()) or "none"))
+
+    lines += ["", "{:<45} {:>7} {:>9} {:>8} {:>9} {:>10}".format("Hook", "Tries", "Match ms", "Handled",
+                                                                   "Handle ms", "ms/handled")]
+    for stats in sorted(report.hooks, key=lambda s: s.match_seconds + s.handle_seconds, reverse=True):
+        lines.append("{:<45} {:>7} {:>9.1f} {:>8} {:>9.1f} {:>10.2f}".format(
+            stats.name[:45],
+            stats.tries,
+            stats.match_seconds * 1000,
+            stats.handled,
+            stats.handle_seconds * 1000,
+            stats.handle_seconds * 1000 / stats.handled if stats.handled else 0))
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark message handling by replaying messages through the hooks.")
+    parser.add_argument("--recording", nargs="+", help="Segments recorded by recorder.py, in order")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="How many times faster than real time to play recordings. 0 for all at once")
+    parser.add_argument("--file", help="RTM messages, one JSON object per line. Made up if not given")
+    parser.add_argument("--events", type=int, default=1000, help="How many messages to make up")
+    parser.add_argument("--brothers", type=int, default=40, help="How many brothers are in the house")
+    parser.add_argument("--rate", type=float, default=0, help="Messages per second to send. 0 for all at once")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for made up messages")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.recording:
+        # Read up front, so decompression doesn't count against the bot
+        records = list(recorder.read_records(args.recording))
+        feed = recorder.replay_events(records, args.speed)
+    else:
+        if args.file:
+            messages = read_messages(args.file)
+        else:
+            brothers = [b for b in scroll_util.all_brothers() if b.is_valid()][:args.brothers]
+            messages = list(synthetic_messages(args.events, brothers, args.seed))
+        feed = paced_events(messages, args.rate)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        report = asyncio.run(replay(feed, args.brothers, workdir))
+    print(format_report(report))
+
+
+if __name__ == '__main__':
+    main()
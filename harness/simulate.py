@@ -0,0 +1,140 @@
+"""
+Simulates days of the bot's timed jobs (reminders, nags, slack refreshes, ...) in seconds, on a virtual clock, against
+fake slack and sheets. Reports how many api calls, and how much real time, each simulated day cost.
+
+Run from the bot's directory, so the family tree can be found:
+    python -m harness.simulate --days 28
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import List
+
+import client
+import google_api
+import scheduler
+from harness import fakes, virtual_time
+from plugins import house_store, identifier, periodicals, scroll_util
+
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+HOUSES = ["Main", "Annex"]
+CHANNELS = ["general", "random", "botzone", "housejobs", "command-center"]
+
+
+@dataclass
+class DayReport(object):
+    day: date
+    slack_calls: Counter
+    sheets_calls: Counter
+    wall_seconds: float
+
+
+def make_house(brother_count: int) -> fakes.FakeSheetsService:
+    """
+    Makes a fake sheet where each of the first brother_count brothers has a job on some day of the week.
+    """
+    brothers = [b for b in scroll_util.all_brothers() if b.is_valid()][:brother_count]
+    jobs = [["Job {}".format(i), HOUSES[i % len(HOUSES)], DAYS_OF_WEEK[i % 7], b.name,
+             house_store.SIGNOFF_PLACEHOLDER, "n", "n"]
+            for i, b in enumerate(brothers)]
+    points = [["Name"] + house_store.POINT_FIELDS[1:]] + [[b.name] for b in brothers]
+    return fakes.FakeSheetsService({house_store.job_range: jobs, house_store.point_range: points})
+
+
+async def simulate(days: int, brother_count: int, workdir: str) -> List[DayReport]:
+    loop = asyncio.get_running_loop()
+    scheduler.set_clock(loop.clock.now)
+
+    # Swap in the fakes, keeping all state in the work dir
+    house_store.DB_PATH = os.path.join(workdir, "house_store.sqlite")
+    identifier.DB_NAME = os.path.join(workdir, "user_scrolls.sqlite")
+    identifier.LEGACY_SHELVE_NAME = os.path.join(workdir, "user_scrolls")
+
+    sheets = make_house(brother_count)
+    google_api.set_sheet_service(sheets)
+
+    brothers = [b for b in scroll_util.all_brothers() if b.is_valid()][:brother_count]
+    slack = fakes.FakeSlackClient([("U{}".format(b.scroll), b.name) for b in brothers], CHANNELS)
+    wrapper = client.ClientWrapper("fake-token")
+    wrapper.slack = slack
+    client.set_slack(wrapper)
+
+    # Everyone is registered, so everyone gets their DMs
+    for b in brothers:
+        await identifier._get_index().register("U{}".format(b.scroll), b.scroll)
+
+    # Start the jobs, exactly as the bot would
+    sched = scheduler.Scheduler(os.path.join(workdir, scheduler.STATE_FILE))
+    periodicals.schedule_periodicals(sched)
+    runner = asyncio.create_task(sched.run())
+
+    # Run a day at a time, from midnight to midnight
+    reports = []
+    for _ in range(days):
+        today = scheduler.now().date()
+        slack_before, sheets_before = Counter(slack.calls), Counter(sheets.calls)
+        start = time.perf_counter()
+
+        midnight = datetime.combine(today + timedelta(days=1), datetime.min.time())
+        await asyncio.sleep(scheduler.seconds_until(midnight))
+
+        reports.append(DayReport(today, slack.calls - slack_before, sheets.calls - sheets_before,
+                                 time.perf_counter() - start))
+
+    runner.cancel()
+    logging.info(sched.describe())
+    return reports
+
+
+def format_report(reports: List[DayReport]) -> str:
+    lines = ["{:<10} {:<10} {:>7} {:>7} {:>9}  {}".format("Date", "Day", "Slack", "Sheets", "Wall ms",
+                                                           "Slack calls by method")]
+    for r in reports:
+        lines.append("{:<10} {:<10} {:>7} {:>7} {:>9.1f}  {}".format(
+            r.day.isoformat(),
+            DAYS_OF_WEEK[r.day.weekday()],
+            sum(r.slack_calls.values()),
+            sum(r.sheets_calls.values()),
+            r.wall_seconds * 1000,
+            ", ".join("{} {}".format(method, n) for method, n in r.slack_calls.most_common())))
+
+    # Totals
+    slack_total = sum(sum(r.slack_calls.values()) for r in reports)
+    sheets_total = sum(sum(r.sheets_calls.values()) for r in reports)
+    wall_total = sum(r.wall_seconds for r in reports)
+    lines.append("{} days: {} slack calls ({:.1f}/day), {} sheets calls, {:.2f}s wall ({:.1f}ms/day)".format(
+        len(reports),
+        slack_total,
+        slack_total / len(reports),
+        sheets_total,
+        wall_total,
+        wall_total * 1000 / len(reports)))
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simulate the bot's timed jobs on a virtual clock.")
+    parser.add_argument("--days", type=int, default=14, help="How many days to simulate")
+    parser.add_argument("--brothers", type=int, default=40, help="How many brothers have jobs")
+    parser.add_argument("--start", type=date.fromisoformat, default=None,
+                        help="Day to start at (YYYY-MM-DD). Defaults to next monday")
+    args = parser.parse_args()
+
+    start = args.start or date.today() + timedelta(days=7 - date.today().weekday())
+    logging.basicConfig(level=logging.WARNING)
+
+    asyncio.set_event_loop_policy(virtual_time.VirtualTimePolicy(datetime.combine(start, datetime.min.time())))
+    with tempfile.TemporaryDirectory() as workdir:
+        reports = asyncio.run(simulate(args.days, args.brothers, workdir))
+    print(format_report(reports))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+An asyncio event loop on a virtual clock.
+
+Whenever the loop would block waiting for a timer, the clock jumps straight to it instead. asyncio.sleep(86400) takes
+no real time at all, so weeks of timed jobs can run in seconds, and always in the same order.
+Executor calls run inline, since a virtual clock can't wait on a real thread.
+"""
+
+import asyncio
+import concurrent.futures
+import selectors
+from datetime import datetime, timedelta
+
+
+class VirtualClock(object):
+    """
+    Seconds elapsed since a virtual start time. Only ever moves when told to.
+    """
+
+    def __init__(self, start: datetime):
+        self.start = start
+        self.elapsed = 0.0
+
+    def advance(self, seconds: float) -> None:
+        self.elapsed += seconds
+
+    def now(self) -> datetime:
+        """
+        The current virtual local time. Pass to scheduler.set_clock.
+        """
+        return self.start + timedelta(seconds=self.elapsed)
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    """
+    Still polls for real IO, but instead of blocking until a timer is due, advances the clock to it.
+    """
+
+    def __init__(self, clock: VirtualClock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        ready = super().select(0)
+        if ready or timeout == 0:
+            return ready
+
+        # Nothing is scheduled at all, so only real IO can wake us
+        if timeout is None:
+            return super().select(None)
+
+        self.clock.advance(timeout)
+        return []
+
+
+class InlineExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    Runs submitted functions immediately, in the calling thread.
+    """
+
+    def submit(self, fn, *args, **kwargs) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    def __init__(self, start: datetime):
+        # The base loop asks the time while setting up, so the clock has to exist first
+        self.clock = VirtualClock(start)
+        super().__init__(_VirtualSelector(self.clock))
+        self.set_default_executor(InlineExecutor())
+
+    def time(self) -> float:
+        return self.clock.elapsed
+
+
+class VirtualTimePolicy(asyncio.DefaultEventLoopPolicy):
+    """
+    Makes every new event loop (e.g. those of asyncio.run) a VirtualTimeLoop, starting at the given time.
+    """
+
+    def __init__(self, start: datetime):
+        super().__init__()
+        self.start = start
+
+    def new_event_loop(self) -> VirtualTimeLoop:
+        return VirtualTimeLoop(self.start)
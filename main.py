@@ -1,8 +1,11 @@
+import argparse
 import asyncio
 import textwrap
 from typing import Match
 
+import diagnostics
 import hooks
+import scheduler
 import settings
 from plugins import identifier, job_commands, management_commands, periodicals, scroll_util, slavestothemachine
 import client
@@ -11,11 +14,49 @@ import slack_util
 
 import logging
 
-logging.basicConfig(filename=settings.LOGFILE, filemode="w", level=logging.DEBUG, format='#!# %(levelname)s - %(asctime)s \n%(message)s \n', datefmt='%m/%d/%Y %I:%M:%S %p')
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Runs the bot.")
+    parser.add_argument("--replay", nargs="+", metavar="SEGMENT",
+                        help="Handle the events in these segments recorded by recorder.py instead of live ones")
+    parser.add_argument("--speed", type=float, default=1,
+                        help="How many times faster than real time to replay. 0 for all at once")
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=settings.LOGFILE, filemode="w", level=logging.DEBUG, format='#!# %(levelname)s - %(asctime)s \n%(message)s \n', datefmt='%m/%d/%Y %I:%M:%S %p')
+
     wrap = client.get_slack()
+    register_hooks(wrap)
+
+    # Add timed jobs: user updating, nagloop, etc.
+    periodicals.schedule_periodicals(scheduler.get_scheduler())
+    wrap.add_passive(scheduler.get_scheduler())
+
+    # Do test.
+    wrap.add_passive(periodicals.TestPassive())
+
+    # Mirror house jobs and points to the sheet
+    wrap.add_passive(periodicals.SheetMirror(60))
+
+    # Get towel standings ready
+    wrap.add_passive(periodicals.LoadTowelLedger())
+
+    # Keep an eye out for anything blocking the event loop
+    wrap.add_passive(diagnostics.get_watchdog())
+
+    event_loop = asyncio.get_event_loop()
+    event_loop.set_debug(settings.USE_ASYNC_DEBUG_MODE)
+    event_handling = wrap.handle_events(args.replay, args.speed)
+    passive_handling = wrap.run_passives()
+    both = asyncio.gather(event_handling, passive_handling)
+
+    event_loop.run_until_complete(both)
+
 
+def register_hooks(wrap: client.ClientWrapper) -> None:
+    """
+    Adds every message hook the bot responds with. Shared with the replay benchmark, so it measures the real thing.
+    """
     # Add scroll handling
     wrap.add_hook(scroll_util.scroll_hook)
 
@@ -28,9 +69,15 @@ def main() -> None:
     # Add kill switch
     wrap.add_hook(management_commands.reboot_hook)
     wrap.add_hook(management_commands.log_hook)
+    wrap.add_hook(management_commands.cache_stats_hook)
+    wrap.add_hook(management_commands.schedule_stats_hook)
+    wrap.add_hook(management_commands.passive_stats_hook)
+    wrap.add_hook(management_commands.lag_report_hook)
+    wrap.add_hook(management_commands.profile_hook)
 
     # Add towel rolling
     wrap.add_hook(slavestothemachine.count_work_hook)
+    wrap.add_hook(slavestothemachine.leaderboard_hook)
     # wrap.add_hook(slavestothemachine.dump_work_hook)
 
     # Add job management
@@ -40,31 +87,13 @@ def main() -> None:
     wrap.add_hook(job_commands.nag_hook)
     wrap.add_hook(job_commands.reassign_hook)
     wrap.add_hook(job_commands.refresh_hook)
+    wrap.add_hook(job_commands.point_history_hook)
+    wrap.add_hook(job_commands.standings_hook)
+    wrap.add_hook(job_commands.week_standings_hook)
 
     # Add help
     wrap.add_hook(hooks.ChannelHook(help_callback, patterns=[r"help", r"bot\s+help"]))
 
-    # Add boozebot
-    # wrap.add_passive(periodicals.ItsTenPM())
-
-    # Add automatic updating of users
-    wrap.add_passive(periodicals.Updatinator(wrap, 120))
-
-    # Do test.
-    wrap.add_passive(periodicals.TestPassive())
-
-    # Add nagloop
-    wrap.add_passive(periodicals.NotifyJobs())
-    wrap.add_passive(periodicals.RemindJobs())
-
-    event_loop = asyncio.get_event_loop()
-    event_loop.set_debug(settings.USE_ASYNC_DEBUG_MODE)
-    event_handling = wrap.handle_events()
-    passive_handling = wrap.run_passives()
-    both = asyncio.gather(event_handling, passive_handling)
-
-    event_loop.run_until_complete(both)
-
 
 # noinspection PyUnusedLocal
 async def help_callback(event: slack_util.Event, match: Match) -> None:
@@ -74,16 +103,29 @@ async def help_callback(event: slack_util.Event, match: Match) -> None:
     "@person has scroll number" : same as above, but for other users. Helpful if they are being obstinate.
     "what is my scroll" : Echos back what the bot thinks your scroll is. Largely for debugging.
     "what is my name" : Echos back what the bot thinks your name is. Largely for debugging. If you want to change this, 
-    you'll need to fix the "Sorted family tree" file that the bot reads. Sorry.
+    you'll need to fix the "Sorted family tree" file that the bot reads. Changes are picked up within a minute.
     "channel id #wherever" : Debug command to get a slack channels full ID
     "reboot" : Restarts the server.
+    "cache stats" : Shows how well name lookups are being cached. Only in #botzone.
+    "schedule stats" : Shows when timed jobs (reminders, etc.) last ran, how long they took, and when they run next.
+    Only in #botzone.
+    "passive stats" : Shows how many times each background task has crashed and been restarted. Only in #botzone.
+    "lag report" : Shows how responsive the bot has been, and what code has been holding it up. Only in #botzone.
+    "profile 30s" : Profiles the bot for the given number of seconds, then posts where the time went.
+    Only in #command-center.
     "signoff John Doe" : Sign off a brother's house job. Will prompt for more information if needed.
     "marklate John Doe" : Same as above, but to mark a job as being completed but having been done late.
     "reassign John Doe -> James Deer" : Reassign a house job.
     "undo signoff John Doe" : Marks a brother's house job as incomplete. Useful if you fucked up.
+    The above all accept several brothers at once, separated by commas or newlines, e.g. "signoff John Doe, Jane Doe".
     "nagjobs day" : Notify in general the house jobs for the week.
     "reset signoffs" : Clear points for the week, and undo all signoffs. Not frequently useful, admin only.
     "refresh points" : Updates house job / signoff points for the week, after manual edits to the sheet. Admin only.
+    "point history" : Shows your total points for each past week.
+    "standings" : Shows who has the most points so far this week.
+    "week standings" : Shows the points archived by this week's reset, best first.
+    "leaderboard" : Shows who has done the most towel work since the last reset. Add a word such as "washed" to rank
+    by just that kind of work. "towel stats" works too.
     "help" : You're reading it. This is all it does. What do you want from me?
     
     ---
@@ -1,17 +1,17 @@
-import dataclasses
+import asyncio
 from dataclasses import dataclass
 from datetime import date, timedelta
-from typing import Tuple, List, Optional, Any
+from typing import Tuple, List, Optional, Any, Dict
 
-import google_api
-from plugins import scroll_util
+import numpy as np
 
-SHEET_ID = "1f9p4H7TWPm8rAM4v_qr2Vc6lBiFNEmR-quTY9UtxEBI"
+import scheduler
+from plugins import scroll_util, house_store
 
-# Note: These ranges use named range feature of google sheets.
-# To edit range of jobs, edit the named range in Data -> Named Ranges
-job_range = "AllJobs"  # Note that the first row is headers
-point_range = "PointRange"
+# The sheet is now just a mirror of house_store. These are kept for reference
+SHEET_ID = house_store.SHEET_ID
+job_range = house_store.job_range
+point_range = house_store.point_range
 
 # How tolerant of spelling errors in names to be
 SHEET_LOOKUP_THRESHOLD = 80.0
@@ -23,7 +23,7 @@ SIGNOFF_VAL = 0.1
 TOWEL_VAL = 0.1
 
 # What to put for a non-signed-off job
-SIGNOFF_PLACEHOLDER = "E-SIGNOFF"
+SIGNOFF_PLACEHOLDER = house_store.SIGNOFF_PLACEHOLDER
 NOT_ASSIGNED = "N/A"
 
 
@@ -62,66 +62,197 @@ class JobAssignment(object):
         return self.job.name, self.job.house, self.job.day_of_week, assignee, signer_name, late, bonus
 
 
-@dataclass
-class PointStatus(object):
+class JobSnapshot(object):
     """
-    Tracks a brothers points
+    Every job assignment, 1:1 with the sheet, indexed by assignee.
     """
-    brother: scroll_util.Brother
-    job_points: float = 0
-    signoff_points: float = 0
-    towel_points: float = 0
-    work_party_points: float = 0
-    bonus_points: float = 0
 
-    def to_raw(self) -> Tuple[str, float, float, float, float, float]:
-        # Convert to a row. Also, do some rounding while we're at it
-        def fmt(x: float):
-            return round(x, 2)
+    def __init__(self, assigns: List[Optional[JobAssignment]]):
+        self.assigns = assigns
+        self.by_assignee: Dict[scroll_util.Brother, List[JobAssignment]] = {}
+        self.unresolved: List[JobAssignment] = []
+        self.reindex()
+
+    def reindex(self) -> None:
+        """
+        Rebuilds the assignee index. Call after changing any assignees.
+        """
+        self.by_assignee = {}
+        self.unresolved = []  # Assignments whose assignee couldn't be found in the family tree
+        for a in self.assigns:
+            if a is None or a.assignee is None:
+                continue
+            self.by_assignee.setdefault(a.assignee, []).append(a)
+            if not a.assignee.is_valid():
+                self.unresolved.append(a)
+
+
+# The point categories, in sheet column order (after the name column)
+POINT_CATEGORIES = house_store.POINT_FIELDS[1:]
+
+class PointTable(object):
+    """
+    Tracks every brothers points, column-wise. Each category is a numpy array, indexed by row.
+    Rows are 1:1 with the point sheet. Blank rows have a brother of None.
+    """
 
-        return (self.brother.name,
-                fmt(self.job_points),
-                fmt(self.signoff_points),
-                fmt(self.towel_points),
-                fmt(self.work_party_points),
-                fmt(self.bonus_points),
-                )
+    def __init__(self, headers: List[str], brothers: List[Optional[scroll_util.Brother]]):
+        self.headers = headers
+        self.brothers = brothers
+        self.columns: Dict[str, np.ndarray] = {c: np.zeros(len(brothers)) for c in POINT_CATEGORIES}
+
+        # Map each brother to their row(s)
+        self.index: Dict[scroll_util.Brother, List[int]] = {}
+        for i, b in enumerate(brothers):
+            if b is not None:
+                self.index.setdefault(b, []).append(i)
+
+    def rows_of(self, brother: scroll_util.Brother) -> List[int]:
+        return self.index.get(brother, [])
+
+    def reset(self) -> None:
+        """
+        Zeroes every category.
+        """
+        for column in self.columns.values():
+            column.fill(0)
+
+    def totals(self) -> np.ndarray:
+        """
+        Gets each row's total points.
+        """
+        return sum(self.columns.values())
+
+    def to_rows(self) -> List[Optional[List[Any]]]:
+        # Convert to rows. Also, do some rounding while we're at it
+        rounded = [np.round(self.columns[c], 2).tolist() for c in POINT_CATEGORIES]
+        return [[b.name] + [column[i] for column in rounded] if b is not None else None
+                for i, b in enumerate(self.brothers)]
+
+    def towel_contribution_count(self, brother: scroll_util.Brother) -> int:
+        """
+        Gets how many towel contributions a brother has made.
+        :raises KeyError: If there is no row for the brother
+        """
+        rows = self.rows_of(brother)
+        if not rows:
+            raise KeyError("No score entry found for brother {}".format(brother))
+        return round(self.columns["towel_points"][rows[0]] / TOWEL_VAL)
+
+    def add_towel_contributions(self, brother: scroll_util.Brother, count: int) -> int:
+        """
+        Grants count towel contributions to a brother, returning their new contribution count.
+        :raises KeyError: If there is no row for the brother
+        """
+        new_count = self.towel_contribution_count(brother) + count
+        self.columns["towel_points"][self.rows_of(brother)[0]] = new_count * TOWEL_VAL
+        return new_count
+
+
+# Raw sheet name -> (best match, match ratio). The names on the sheet rarely change, so this saves a lot of fuzzy
+# matching on each import. Cleared whenever the family tree is reloaded.
+_resolved_names: Dict[str, Tuple[scroll_util.Brother, float]] = {}
+scroll_util.add_reload_listener(_resolved_names.clear)
+
+
+async def resolve_sheet_name(name: str, threshold: Optional[float] = None) -> scroll_util.Brother:
+    """
+    Equivalent to scroll_util.find_by_name, but remembers results for each raw name seen on the sheet.
 
-    @property
-    def towel_contribution_count(self) -> int:
-        return round(self.towel_points / TOWEL_VAL)
+    :raises BrotherNotFound:
+    """
+    resolved = _resolved_names.get(name)
+    if resolved is None:
+        resolved = await scroll_util.find_by_name_scored(name)
+        _resolved_names[name] = resolved
 
-    @towel_contribution_count.setter
-    def towel_contribution_count(self, val: int) -> None:
-        self.towel_points = val * TOWEL_VAL
+    brother, score = resolved
+    return scroll_util.check_threshold(name, brother, score, threshold)
 
 
-def strip_all(l: List[str]) -> List[str]:
-    return [x.strip() for x in l]
+async def _prefetch_sheet_names(names: List[str]) -> None:
+    """
+    Resolves every not-yet-seen name in a single batch, so that subsequent resolve_sheet_name calls are all cache hits.
+    """
+    unseen = list({name for name in names if name not in _resolved_names})
+    for name, resolved in zip(unseen, await scroll_util.resolve_many(unseen)):
+        _resolved_names[name] = resolved
 
 
-async def import_assignments() -> List[Optional[JobAssignment]]:
+async def _parse_assignment(row: List[str]) -> JobAssignment:
     """
-    Imports Jobs and JobAssignments from the sheet. 1:1 row correspondence.
+    Converts a normalised job row into a JobAssignment
     """
-    # Get the raw data
-    job_rows = google_api.get_sheet_range(SHEET_ID, job_range)
-
-    # None-out invalid rows (length not at least 4, which includes the 4 most important features)
-    def fixer(row):
-        if len(row) == 4:
-            return strip_all(row + [SIGNOFF_PLACEHOLDER, "n", "n"])
-        elif len(row) == 5:
-            return strip_all(row + ["n", "n"])
-        elif len(row) == 6:
-            return strip_all(row + ["n"])
-        elif len(row) == 7:
-            return strip_all(row)
+    # Breakout list
+    job_name, location, day, assignee, signer, late, bonus = row
+
+    # Figure out when the day actually is, in terms of the date class
+    day_rank = {
+        "monday": 0,
+        "tuesday": 1,
+        "wednesday": 2,
+        "thursday": 3,
+        "friday": 4,
+        "saturday": 5,
+        "sunday": 6
+    }.get(day.lower(), None)
+
+    if day_rank is not None:
+        # Figure out current date day of week, and extrapolate the jobs day of week from there
+        today = scheduler.now().date()
+        today_rank = today.weekday()
+
+        days_till = day_rank - today_rank
+        if days_till <= 0:
+            days_till += 7
+
+        # Now we know what day it is!
+        job_day = today + timedelta(days=days_till)
+    else:
+        # Can't win 'em all
+        job_day = None
+
+    # Create the job
+    job = Job(name=job_name, house=location, day_of_week=day, day=job_day)
+
+    # Now make an assignment for the job
+    # Find the brother it is assigned to
+    if assignee is not None and assignee != "" and assignee != NOT_ASSIGNED:
+        try:
+            assignee = await resolve_sheet_name(assignee, SHEET_LOOKUP_THRESHOLD)
+        except scroll_util.BrotherNotFound:
+            # If we can't get one close enough, make a dummy
+            assignee = scroll_util.missing_brother(assignee)
+    else:
+        assignee = None
+
+    # Find the brother who is currently listed as having signed it off
+    try:
+        if signer in ("", SIGNOFF_PLACEHOLDER):
+            signer = None
         else:
-            return None
+            signer = await resolve_sheet_name(signer)
+    except scroll_util.BrotherNotFound:
+        # If we can't figure out the name
+        signer = None
+
+    # Make late a bool
+    late = late == "y"
+
+    # Ditto for bonus
+    bonus = bonus == "y"
 
-    # Apply the fix
-    job_rows = [fixer(row) for row in job_rows]
+    # Create the assignment
+    return JobAssignment(job=job, assignee=assignee, signer=signer, late=late, bonus=bonus)
+
+
+async def _parse_assignments(job_rows: List[Optional[List[str]]]) -> List[Optional[JobAssignment]]:
+    """
+    Converts every normalised job row into a JobAssignment, leaving blank rows as None.
+    """
+    # Resolve every assignee and signer at once
+    await _prefetch_sheet_names([name for row in job_rows if row is not None for name in (row[3], row[4])
+                                 if name not in ("", NOT_ASSIGNED, SIGNOFF_PLACEHOLDER)])
 
     # Now, create jobs
     assignments = []
@@ -129,173 +260,203 @@ async def import_assignments() -> List[Optional[JobAssignment]]:
         if row is None:
             assignments.append(None)
         else:
-            # Breakout list
-            job_name, location, day, assignee, signer, late, bonus = row
-
-            # Figure out when the day actually is, in terms of the date class
-            day_rank = {
-                "monday": 0,
-                "tuesday": 1,
-                "wednesday": 2,
-                "thursday": 3,
-                "friday": 4,
-                "saturday": 5,
-                "sunday": 6
-            }.get(day.lower(), None)
-
-            if day_rank is not None:
-                # Figure out current date day of week, and extrapolate the jobs day of week from there
-                today = date.today()
-                today_rank = today.weekday()
-
-                days_till = day_rank - today_rank
-                if days_till <= 0:
-                    days_till += 7
-
-                # Now we know what day it is!
-                job_day = today + timedelta(days=days_till)
-            else:
-                # Can't win 'em all
-                job_day = None
-
-            # Create the job
-            job = Job(name=job_name, house=location, day_of_week=day, day=job_day)
-
-            # Now make an assignment for the job
-            # Find the brother it is assigned to
-            if assignee is not None and assignee != "" and assignee != NOT_ASSIGNED:
-                try:
-                    assignee = await scroll_util.find_by_name(assignee, SHEET_LOOKUP_THRESHOLD)
-                except scroll_util.BrotherNotFound:
-                    # If we can't get one close enough, make a dummy
-                    assignee = scroll_util.Brother(assignee, scroll_util.MISSINGBRO_SCROLL)
-            else:
-                assignee = None
-
-            # Find the brother who is currently listed as having signed it off
-            try:
-                if signer == SIGNOFF_PLACEHOLDER:
-                    signer = None
-                else:
-                    signer = await scroll_util.find_by_name(signer)
-            except scroll_util.BrotherNotFound:
-                # If we can't figure out the name
-                signer = None
-
-            # Make late a bool
-            late = late == "y"
-
-            # Ditto for bonus
-            bonus = bonus == "y"
-
-            # Create the assignment
-            assignment = JobAssignment(job=job, assignee=assignee, signer=signer, late=late, bonus=bonus)
-
-            # Append to job/assignment lists
-            assignments.append(assignment)
+            assignments.append(await _parse_assignment(row))
 
     # Git 'em gone
     return assignments
 
 
-async def export_assignments(assigns: List[Optional[JobAssignment]]) -> None:
-    # Smash to rows
-    rows = []
-    for v in assigns:
-        if v is None:
-            rows.append([""] * 7)
-        else:
-            rows.append(list(v.to_raw()))
+# The current snapshot, shared by everyone, along with what it was imported from.
+# Job days are relative to today, so a snapshot also goes stale at midnight.
+_snapshot: Optional[JobSnapshot] = None
+_snapshot_version: Optional[int] = None
+_snapshot_day: Optional[date] = None
+_snapshot_lock = asyncio.Lock()
+
 
-    # Send to google
-    google_api.set_sheet_range(SHEET_ID, job_range, rows)
+def invalidate_snapshot() -> None:
+    """
+    Forces the next get_snapshot to re-import.
+    """
+    global _snapshot
+    _snapshot = None
 
 
-async def import_points() -> (List[str], List[PointStatus]):
-    # Figure out how many things there are in a point status
-    field_count = len(dataclasses.fields(PointStatus))
+# Assignees are brothers, so they need to be found again if the family tree changes
+scroll_util.add_reload_listener(invalidate_snapshot)
 
-    # Get the raw data
-    point_rows = google_api.get_sheet_range(SHEET_ID, point_range)
 
-    # Get the headers
-    headers = point_rows[0]
-    point_rows = point_rows[1:]
+async def get_snapshot() -> JobSnapshot:
+    """
+    Gets the shared snapshot of every JobAssignment. Only re-imports if the store has been written by someone else
+    (e.g. the sheet mirror pulling in manual edits), the day has changed, or it has been invalidated.
+    The snapshot is shared, so only modify it if you are about to export_assignments its assigns.
+    """
+    global _snapshot, _snapshot_version, _snapshot_day
+    async with _snapshot_lock:
+        if _snapshot is None or _snapshot_version != house_store.get_version("assignments") \
+                or _snapshot_day != scheduler.now().date():
+            job_rows, version = await house_store.load_versioned_assignment_rows()
+            _snapshot_day = scheduler.now().date()
+            _snapshot = JobSnapshot(await _parse_assignments(job_rows))
+            _snapshot_version = version
+        return _snapshot
+
+
+async def query_assignments(assignee: Optional[str] = None,
+                            day_of_week: Optional[str] = None,
+                            house: Optional[str] = None) -> List[JobAssignment]:
+    """
+    Gets only the JobAssignments matching all of the given (case insensitive) criteria, from the shared snapshot.
+    Not for modifying.
+    """
+    def matches(value: Optional[str], criteria: Optional[str]) -> bool:
+        return criteria is None or (value is not None and value.lower() == criteria.lower())
+
+    return [a for a in (await get_snapshot()).assigns
+            if a is not None
+            and matches(a.assignee.name if a.assignee else None, assignee)
+            and matches(a.job.day_of_week, day_of_week)
+            and matches(a.job.house, house)]
 
-    # Tidy rows up
-    async def converter(row: List[Any]) -> Optional[PointStatus]:
-        # If its too long, or empty already, ignore
-        if len(row) == 0 or len(row) > field_count:
-            return None
 
-        # Ensure its the proper length
-        while len(row) < field_count:
-            row: List[Any] = row + [0]
+async def export_assignments(assigns: List[Optional[JobAssignment]]) -> None:
+    global _snapshot_version
 
-        # Ensure all past the first column are float. If can't convert, make 0
-        for i in range(1, len(row)):
-            try:
-                x = float(row[i])
-            except ValueError:
-                x = 0
-            row[i] = x
+    # Smash to rows
+    rows = [list(v.to_raw()) if v is not None else None for v in assigns]
 
-        # Get the brother for the last item
-        try:
-            brother = await scroll_util.find_by_name(row[0])
-        except scroll_util.BrotherNotFound:
-            brother = scroll_util.Brother(row[0], scroll_util.MISSINGBRO_SCROLL)
+    # Save locally. The sheet mirror will pick it up
+    version = house_store.save_assignment_rows(rows)
 
-        # Ok! Now, we just map it directly to a PointStatus
-        status = PointStatus(brother, *(row[1:]))
-        return status
+    # If these were the shared snapshot's assigns, it is now exactly what's stored, so keep it. Otherwise it's stale
+    if _snapshot is not None and assigns is _snapshot.assigns:
+        _snapshot.reindex()
+        _snapshot_version = version
+    else:
+        invalidate_snapshot()
 
-    # Perform conversion and return
-    point_statuses = [await converter(row) for row in point_rows]
-    return headers, point_statuses
 
+async def import_points() -> PointTable:
+    # Get the normalised rows
+    headers, point_rows = await house_store.load_point_rows()
+    await _prefetch_sheet_names([row[0] for row in point_rows if row is not None])
 
-def export_points(headers: List[str], points: List[PointStatus]) -> None:
-    # Smash to rows
-    rows = [list(point_status.to_raw()) for point_status in points]
-    rows = [headers] + rows
+    # Get the brother for each row
+    brothers = []
+    for row in point_rows:
+        # If it wasn't a valid row, ignore
+        if row is None:
+            brothers.append(None)
+            continue
+
+        try:
+            brother = await resolve_sheet_name(row[0])
+        except scroll_util.BrotherNotFound:
+            brother = scroll_util.missing_brother(row[0])
+        brothers.append(brother)
+
+    # Ok! Now, we just map the values directly to columns
+    table = PointTable(headers, brothers)
+    for i, category in enumerate(POINT_CATEGORIES):
+        table.columns[category][:] = [row[i + 1] if row is not None else 0 for row in point_rows]
+    return table
 
-    # Send to google
-    google_api.set_sheet_range(SHEET_ID, point_range, rows)
 
+def export_points(points: PointTable) -> None:
+    # Save locally. The sheet mirror will pick it up
+    house_store.save_point_rows(points.headers, points.to_rows())
 
-def apply_house_points(points: List[PointStatus], assigns: List[Optional[JobAssignment]]):
+
+def _score_assignments(points: PointTable, assigns: List[Optional[JobAssignment]], sign: int) -> None:
+    """
+    Adds (sign=1) or removes (sign=-1) the scores of the given assignments from the points table.
     """
-    Modifies the points list to reflect job assignment scores.
+    # Ignore null assigns
+    assigns = [a for a in assigns if a is not None]
+
+    # What modifier should each have?
+    signed = np.array([a.signer is not None for a in assigns], dtype=bool)
+    late = np.array([a.late for a in assigns], dtype=bool)
+    job_scores = sign * np.where(signed, np.where(late, LATE_VAL, JOB_VAL), MISS_VAL)
+
+    # Find the rows of the corr bros in points
+    job_rows = []
+    job_row_scores = []
+    signoff_rows = []
+    for a, job_score in zip(assigns, job_scores):
+        if a.assignee is not None:
+            assignee_rows = points.rows_of(a.assignee)
+            job_rows += assignee_rows
+            job_row_scores += [job_score] * len(assignee_rows)
+        if a.signer is not None:
+            signoff_rows += points.rows_of(a.signer)
+
+    # Apply them all at once. Using add.at so that repeated rows accumulate
+    np.add.at(points.columns["job_points"], np.array(job_rows, dtype=int), np.array(job_row_scores))
+    np.add.at(points.columns["signoff_points"], np.array(signoff_rows, dtype=int), sign * SIGNOFF_VAL)
+
+
+def apply_house_points(points: PointTable, assigns: List[Optional[JobAssignment]]):
+    """
+    Modifies the points table to reflect job assignment scores.
     Destroys existing values in the column.
-    Should be called each time we re-export, for validations sake.
+    Should be called after manual edits to the sheet, for validations sake. See recompute_house_points.
     """
     # First, eliminate all house points and signoff points
-    for p in points:
-        p.job_points = 0
-        p.signoff_points = 0
+    points.columns["job_points"].fill(0)
+    points.columns["signoff_points"].fill(0)
 
     # Then, apply each assign
-    for a in assigns:
-        # Ignore null assigns
-        if a is None:
-            continue
+    _score_assignments(points, assigns, 1)
 
-        # What modifier should this have?
-        if a.signer is None:
-            job_score = MISS_VAL
-        else:
-            if a.late:
-                job_score = LATE_VAL
-            else:
-                job_score = JOB_VAL
-
-        # Find the corr bro in points
-        for p in points:
-            # If we find assignee, add the score, but don't stop looking since we also need to find signer
-            if p.brother == a.assignee:
-                p.job_points += job_score
-
-            # If we find the signer, add a signoff reward
-            if p.brother == a.signer:
-                p.signoff_points += SIGNOFF_VAL
+
+async def recompute_house_points() -> None:
+    """
+    Rederives everyone's job and signoff points from the current assignments, saving them if they were off.
+    Run whenever assignments change other than through rescore_house_points, e.g. by someone editing the sheet.
+    """
+    points = await import_points()
+    before = points.to_rows()
+    apply_house_points(points, (await get_snapshot()).assigns)
+    if points.to_rows() != before:
+        export_points(points)
+
+
+def rescore_house_points(points: PointTable,
+                         changes: List[Tuple[Optional[JobAssignment], Optional[JobAssignment]]]) -> None:
+    """
+    Incrementally updates the points table to reflect changed assignments, given as (before, after) pairs.
+    Assumes the points already reflect the "before" state of every changed assignment.
+    """
+    _score_assignments(points, [before for before, _ in changes], -1)
+    _score_assignments(points, [after for _, after in changes], 1)
+
+
+def _week_label(day: date) -> str:
+    year, week, _ = day.isocalendar()
+    return "{}-W{:02d}".format(year, week)
+
+
+def archive_points(points: PointTable, day: Optional[date] = None) -> None:
+    """
+    Appends the current points to the weekly history, under the week containing day (by default, today).
+    """
+    day = day or scheduler.now().date()
+    rows = [(b.scroll, b.name, *(float(points.columns[c][i]) for c in POINT_CATEGORIES))
+            for i, b in enumerate(points.brothers) if b is not None]
+    house_store.append_point_history(_week_label(day), rows)
+
+
+def point_trend(brother: scroll_util.Brother) -> List[Tuple[str, float]]:
+    """
+    Gets a brothers archived total points for each week, oldest first.
+    """
+    return house_store.point_history_totals(brother.scroll, brother.name)
+
+
+def week_standings(day: Optional[date] = None) -> List[Tuple[str, float]]:
+    """
+    Gets every brothers archived total points for the week containing day (by default, today), best first.
+    """
+    return house_store.point_history_standings(_week_label(day or scheduler.now().date()))
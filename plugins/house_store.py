@@ -0,0 +1,492 @@
+"""
+Local system of record for house jobs and points.
+
+The google sheet used to be the only copy of this data. Now everything is kept in a local sqlite db, and the sheet
+is treated as a mirror that is kept in sync in the background. Manual edits made to the sheet are merged back in.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Any, Callable, Tuple
+
+import google_api
+import sqlite_util
+
+DB_PATH = "house_store.sqlite"
+
+SHEET_ID = "1f9p4H7TWPm8rAM4v_qr2Vc6lBiFNEmR-quTY9UtxEBI"
+
+# Note: These ranges use named range feature of google sheets.
+# To edit range of jobs, edit the named range in Data -> Named Ranges
+job_range = "AllJobs"  # Note that the first row is headers
+point_range = "PointRange"
+
+# What to put for a non-signed-off job
+SIGNOFF_PLACEHOLDER = "E-SIGNOFF"
+
+ASSIGNMENT_FIELDS = ["job_name", "house", "day_of_week", "assignee", "signer", "late", "bonus"]
+POINT_FIELDS = ["name", "job_points", "signoff_points", "towel_points", "work_party_points", "bonus_points"]
+
+# A normalised row is a list of values, or None for a blank/invalid row
+Row = Optional[List[Any]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assignments (
+    row_index INTEGER PRIMARY KEY,
+    job_name TEXT,
+    house TEXT,
+    day_of_week TEXT,
+    assignee TEXT,
+    signer TEXT,
+    late TEXT,
+    bonus TEXT
+);
+
+CREATE TABLE IF NOT EXISTS points (
+    row_index INTEGER PRIMARY KEY,
+    name TEXT,
+    job_points REAL,
+    signoff_points REAL,
+    towel_points REAL,
+    work_party_points REAL,
+    bonus_points REAL
+);
+
+-- The rows as they were last seen in/pushed to the sheet. Base of the three way merge.
+CREATE TABLE IF NOT EXISTS mirror (
+    table_name TEXT PRIMARY KEY,
+    rows TEXT NOT NULL
+);
+
+-- Append only archive of each brothers points, taken whenever the week's points are reset
+CREATE TABLE IF NOT EXISTS point_history (
+    archive INTEGER NOT NULL,
+    week TEXT NOT NULL,
+    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    scroll INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    job_points REAL,
+    signoff_points REAL,
+    towel_points REAL,
+    work_party_points REAL,
+    bonus_points REAL
+);
+CREATE INDEX IF NOT EXISTS point_history_by_week ON point_history(week, archive);
+CREATE INDEX IF NOT EXISTS point_history_by_brother ON point_history(scroll, name);
+
+-- Append only record of every towel contribution. Period counts up each time points are reset
+CREATE TABLE IF NOT EXISTS towel_ledger (
+    entry INTEGER PRIMARY KEY AUTOINCREMENT,
+    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    period INTEGER NOT NULL,
+    scroll INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    verb TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Sqlite connection, opened on first use. All access goes through _db_lock, since the sync engine runs in a thread.
+_db = None
+_db_lock = threading.RLock()
+
+# Set whenever we write locally, to wake up the mirror early
+_sync_requested = asyncio.Event()
+
+
+def _get_db():
+    global _db
+    with _db_lock:
+        if _db is None:
+            _db = sqlite_util.connect(DB_PATH)
+            _db.executescript(_SCHEMA)
+        return _db
+
+
+def strip_all(l: List[str]) -> List[str]:
+    return [x.strip() for x in l]
+
+
+def _is_blank(row: List[Any]) -> bool:
+    """
+    Whether a raw sheet row has nothing in it. Deleted rows are written to the sheet as empty strings.
+    """
+    return all(str(x).strip() == "" for x in row)
+
+
+def normalise_assignment_row(row: List[str]) -> Row:
+    """
+    Pads a raw sheet row out to the full 7 columns. Rows missing any of the 4 most important features become None,
+    as do blanked out rows.
+    """
+    if _is_blank(row):
+        return None
+    elif len(row) == 4:
+        return strip_all(row + [SIGNOFF_PLACEHOLDER, "n", "n"])
+    elif len(row) == 5:
+        return strip_all(row + ["n", "n"])
+    elif len(row) == 6:
+        return strip_all(row + ["n"])
+    elif len(row) == 7:
+        return strip_all(row)
+    else:
+        return None
+
+
+def normalise_point_row(row: List[Any]) -> Row:
+    """
+    Pads a raw sheet row out to a name and 5 point values. Empty or overlong rows become None.
+    """
+    field_count = len(POINT_FIELDS)
+
+    # If its too long, or empty already, ignore
+    if _is_blank(row) or len(row) > field_count:
+        return None
+
+    # Ensure its the proper length
+    row = list(row) + [0] * (field_count - len(row))
+
+    # Ensure all past the first column are float. If can't convert, make 0. Round to what we'd write to the sheet.
+    for i in range(1, len(row)):
+        try:
+            x = round(float(row[i]), 2)
+        except ValueError:
+            x = 0
+        row[i] = x
+    return row
+
+
+@dataclass
+class _Table:
+    """
+    Describes how one store table maps onto a sheet range.
+    """
+    name: str
+    fields: List[str]
+    sheet_range: str
+    normaliser: Callable[[List[Any]], Row]
+    has_headers: bool
+
+
+_assignment_table = _Table("assignments", ASSIGNMENT_FIELDS, job_range, normalise_assignment_row, False)
+_point_table = _Table("points", POINT_FIELDS, point_range, normalise_point_row, True)
+
+
+"""
+Raw table access. Callers hold _db_lock.
+"""
+
+
+def _read_rows(table: _Table) -> List[Row]:
+    cursor = _get_db().execute("SELECT row_index, {} FROM {} ORDER BY row_index".format(", ".join(table.fields),
+                                                                                          table.name))
+    rows: List[Row] = []
+    for row_index, *values in cursor:
+        # Fill any holes left by blank rows
+        while len(rows) < row_index:
+            rows.append(None)
+        rows.append(None if values[0] is None else list(values))
+    return rows
+
+
+def _write_rows(table: _Table, rows: List[Row]) -> None:
+    db = _get_db()
+    placeholders = ", ".join("?" * (len(table.fields) + 1))
+    with db:
+        db.execute("DELETE FROM {}".format(table.name))
+        db.executemany("INSERT INTO {} VALUES ({})".format(table.name, placeholders),
+                       [[i] + (row if row is not None else [None] * len(table.fields)) for i, row in enumerate(rows)])
+        _bump_version(table)
+
+
+def _bump_version(table: _Table) -> None:
+    _get_db().execute("INSERT INTO meta VALUES (?, '1') "
+                      "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+                      ["version:" + table.name])
+
+
+def _get_meta(key: str) -> Optional[str]:
+    row = _get_db().execute("SELECT value FROM meta WHERE key = ?", [key]).fetchone()
+    return row[0] if row else None
+
+
+def _set_meta(key: str, value: str) -> None:
+    with _get_db() as db:
+        db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", [key, value])
+
+
+def _read_mirror(table: _Table) -> Optional[List[Row]]:
+    row = _get_db().execute("SELECT rows FROM mirror WHERE table_name = ?", [table.name]).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def _write_mirror(table: _Table, rows: List[Row]) -> None:
+    with _get_db() as db:
+        db.execute("INSERT OR REPLACE INTO mirror VALUES (?, ?)", [table.name, json.dumps(rows)])
+
+
+def get_version(table_name: str) -> int:
+    """
+    Gets a counter that increases every time the given table is written, locally or by the mirror.
+    """
+    with _db_lock:
+        return int(_get_meta("version:" + table_name) or 0)
+
+
+"""
+Sheet mirroring
+"""
+
+
+def _fetch_sheet(table: _Table) -> Tuple[List[str], List[Row]]:
+    """
+    Reads and normalises the sheet side of a table. Returns headers (if any) and rows.
+    Never uses cached values. Merging in a stale copy of the sheet would undo any local edits made since.
+    :raises SheetsUnavailable: If sheets is degraded
+    """
+    raw_rows = google_api.get_sheet_range(SHEET_ID, table.sheet_range, allow_cached=False)
+    headers = []
+    if table.has_headers and raw_rows:
+        headers, raw_rows = raw_rows[0], raw_rows[1:]
+    return headers, [table.normaliser(r) for r in raw_rows]
+
+
+def _push_sheet(table: _Table, headers: List[str], rows: List[Row]) -> None:
+    blank = [""] * len(table.fields)
+    raw_rows = [row if row is not None else blank for row in rows]
+    if table.has_headers:
+        raw_rows = [headers] + raw_rows
+    google_api.set_sheet_range(SHEET_ID, table.sheet_range, raw_rows)
+
+
+def _merge(base: List[Row], local: List[Row], remote: List[Row]) -> Tuple[List[Row], int]:
+    """
+    Row-wise three way merge. Rows changed only on the sheet take the sheet version; otherwise the local version wins.
+    Returns the merged rows, and how many rows were changed on both sides.
+    """
+    length = max(len(base), len(local), len(remote))
+
+    def get(rows: List[Row], i: int) -> Row:
+        return rows[i] if i < len(rows) else None
+
+    merged = []
+    conflicts = 0
+    for i in range(length):
+        b, l, r = get(base, i), get(local, i), get(remote, i)
+        if l == b:
+            merged.append(r)
+        else:
+            if r != b and r != l:
+                conflicts += 1
+            merged.append(l)
+
+    return merged, conflicts
+
+
+def _trimmed(rows: List[Row]) -> List[Row]:
+    """
+    Drops trailing blank rows, which the sheet api omits, so that equivalent tables compare equal.
+    """
+    end = len(rows)
+    while end and rows[end - 1] is None:
+        end -= 1
+    return rows[:end]
+
+
+def _sync_table(table: _Table) -> bool:
+    """
+    Synchronises a table with its sheet. Blocking; run in an executor.
+    Returns whether any edits were pulled from the sheet.
+    """
+    headers, remote = _fetch_sheet(table)
+
+    with _db_lock:
+        local = _read_rows(table)
+        base = _read_mirror(table)
+
+        # If we've never mirrored, the sheet is all we have to go on
+        if base is None:
+            base = remote if local else []
+        merged, conflicts = _merge(base, local, remote)
+
+        if conflicts:
+            logging.warning("{} rows of {} were edited both locally and on the sheet. "
+                            "Keeping local edits.".format(conflicts, table.name))
+        pulled = _trimmed(merged) != _trimmed(local)
+        if pulled:
+            logging.info("Pulled sheet edits to {}".format(table.name))
+            _write_rows(table, merged)
+        if table.has_headers:
+            _set_meta("headers:" + table.name, json.dumps(headers))
+
+    if _trimmed(merged) != _trimmed(remote):
+        logging.info("Pushing local edits to {} to the sheet".format(table.name))
+        _push_sheet(table, headers, merged)
+
+    with _db_lock:
+        _write_mirror(table, merged)
+    return pulled
+
+
+def sync_all() -> bool:
+    """
+    Synchronises every table with the sheet. Blocking; run in an executor.
+    Returns whether any edits were pulled from the sheet.
+    """
+    pulled = False
+    for table in [_assignment_table, _point_table]:
+        pulled = _sync_table(table) or pulled
+    return pulled
+
+
+async def _ensure_seeded(table: _Table) -> None:
+    """
+    If a table has never been pulled from the sheet, does so now.
+    """
+    with _db_lock:
+        seeded = _read_mirror(table) is not None
+    if not seeded:
+        await asyncio.get_running_loop().run_in_executor(None, _sync_table, table)
+
+
+def request_sync() -> None:
+    """
+    Asks the mirror to push local changes soon, rather than waiting out its interval.
+    """
+    _sync_requested.set()
+
+
+async def wait_for_sync_request(timeout: float) -> None:
+    """
+    Waits until either a sync has been requested, or timeout seconds have passed.
+    """
+    try:
+        await asyncio.wait_for(_sync_requested.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    _sync_requested.clear()
+
+
+"""
+Public store api
+"""
+
+
+async def load_versioned_assignment_rows() -> Tuple[List[Row], int]:
+    """
+    Gets every job row, 1:1 with the sheet, along with the version of the assignments table they were read from.
+    Blank/invalid rows are None.
+    """
+    await _ensure_seeded(_assignment_table)
+    with _db_lock:
+        return _read_rows(_assignment_table), get_version(_assignment_table.name)
+
+
+def save_assignment_rows(rows: List[Row]) -> int:
+    """
+    Replaces every job row. Returns the new version of the assignments table.
+    """
+    with _db_lock:
+        _write_rows(_assignment_table, rows)
+        version = get_version(_assignment_table.name)
+    request_sync()
+    return version
+
+
+async def load_point_rows() -> Tuple[List[str], List[Row]]:
+    """
+    Gets the point headers, and every point row. Blank/invalid rows are None.
+    """
+    await _ensure_seeded(_point_table)
+    with _db_lock:
+        headers = json.loads(_get_meta("headers:points") or "[]")
+        return headers, _read_rows(_point_table)
+
+
+def save_point_rows(headers: List[str], rows: List[Row]) -> None:
+    with _db_lock:
+        _write_rows(_point_table, rows)
+        _set_meta("headers:points", json.dumps(headers))
+    request_sync()
+
+
+"""
+Point history
+"""
+
+# Sums the categories of a point_history row
+_HISTORY_TOTAL = " + ".join(POINT_FIELDS[1:])
+
+
+def append_point_history(week: str, rows: List[Tuple[int, str, float, float, float, float, float]]) -> None:
+    """
+    Archives (scroll, name, *points) rows under the given week label.
+    """
+    with _db_lock, _get_db() as db:
+        archive = db.execute("SELECT COALESCE(MAX(archive), 0) + 1 FROM point_history").fetchone()[0]
+        db.executemany("INSERT INTO point_history (archive, week, scroll, name, {}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                       .format(", ".join(POINT_FIELDS[1:])),
+                       [[archive, week] + list(row) for row in rows])
+
+
+def point_history_totals(scroll: int, name: str) -> List[Tuple[str, float]]:
+    """
+    Gets (week, total) for every archive of the given brother, oldest first.
+    """
+    with _db_lock:
+        return _get_db().execute("SELECT week, {} FROM point_history WHERE scroll = ? AND name = ? "
+                                 "ORDER BY archive".format(_HISTORY_TOTAL), [scroll, name]).fetchall()
+
+
+def point_history_standings(week: str) -> List[Tuple[str, float]]:
+    """
+    Gets (name, total) for every brother archived under the given week, best first.
+    If the week was archived more than once, only the latest archive counts.
+    """
+    with _db_lock:
+        return _get_db().execute("SELECT name, {} AS total FROM point_history WHERE week = ? AND archive = "
+                                 "(SELECT MAX(archive) FROM point_history WHERE week = ?) "
+                                 "ORDER BY total DESC".format(_HISTORY_TOTAL), [week, week]).fetchall()
+
+
+"""
+Towel ledger
+"""
+
+
+def append_towel_entries(entries: List[Tuple[int, int, str, str, int]]) -> None:
+    """
+    Records (period, scroll, name, verb, count) towel contributions.
+    """
+    with _db_lock, _get_db() as db:
+        db.executemany("INSERT INTO towel_ledger (period, scroll, name, verb, count) VALUES (?, ?, ?, ?, ?)", entries)
+
+
+def load_towel_entries() -> List[Tuple[int, int, str, str, int]]:
+    """
+    Gets every (period, scroll, name, verb, count) towel contribution, oldest first.
+    """
+    with _db_lock:
+        return _get_db().execute("SELECT period, scroll, name, verb, count FROM towel_ledger ORDER BY entry").fetchall()
+
+
+def get_towel_period() -> Optional[int]:
+    """
+    Gets the current towel ledger period, or None if the ledger has never been started.
+    """
+    with _db_lock:
+        period = _get_meta("towel_period")
+    return int(period) if period is not None else None
+
+
+def set_towel_period(period: int) -> None:
+    with _db_lock:
+        _set_meta("towel_period", str(period))
@@ -2,16 +2,24 @@
 Allows users to register their user account as a specific scroll
 """
 import asyncio
+import dbm
+import logging
 import shelve
-from typing import List, Match
+from typing import List, Match, Dict, Optional, Iterable
 
 import hooks
 from plugins import scroll_util
 import client
 import slack_util
+import sqlite_util
 
 # The following db maps SLACK_USER_ID -> SCROLL_INTEGER
-DB_NAME = "user_scrolls"
+DB_NAME = "user_scrolls.sqlite"
+
+# The shelve file we used to keep the mapping in. Migrated to DB_NAME the first time it's opened
+LEGACY_SHELVE_NAME = "user_scrolls"
+
+# Serialises writes to the db. Reads are served from memory, and don't need it
 DB_LOCK = asyncio.Lock()
 
 # Initialize the hooks
@@ -20,49 +28,118 @@ NON_REG_MSG = ("You currently have no scroll registered. To register, type\n"
                "except with your scroll instead of 666")
 
 
+class _ScrollIndex(object):
+    """
+    In-memory, two way map between slack ids and scrolls.
+    Loaded from the db once, and written through to it on every change.
+    """
+
+    def __init__(self):
+        self.scroll_of: Dict[str, int] = {}
+        self.ids_of: Dict[int, List[str]] = {}
+
+        # Open the db, creating it if necessary
+        self.db = sqlite_util.connect(DB_NAME)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS user_scrolls "
+                            "(slack_id TEXT PRIMARY KEY, scroll INTEGER NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS user_scrolls_by_scroll ON user_scrolls(scroll)")
+        self._migrate_shelve()
+
+        # Fill from disk
+        for slack_id, scroll in self.db.execute("SELECT slack_id, scroll FROM user_scrolls ORDER BY rowid"):
+            self._put(slack_id, scroll)
+
+    def _migrate_shelve(self) -> None:
+        """
+        Copies registrations over from the legacy shelve, if we haven't already.
+        The db's user_version marks that the migration has been done.
+        """
+        if self.db.execute("PRAGMA user_version").fetchone()[0] >= 1:
+            return
+
+        with self.db:
+            if dbm.whichdb(LEGACY_SHELVE_NAME):
+                with shelve.open(LEGACY_SHELVE_NAME, flag="r") as old_db:
+                    rows = [(slack_id, old_db[slack_id]) for slack_id in old_db.keys()]
+                self.db.executemany("INSERT OR IGNORE INTO user_scrolls VALUES (?, ?)", rows)
+                logging.info("Migrated {} scroll registrations from {}".format(len(rows), LEGACY_SHELVE_NAME))
+            self.db.execute("PRAGMA user_version = 1")
+
+    def _put(self, slack_id: str, scroll: int) -> None:
+        # Unlink the old scroll, if any
+        old_scroll = self.scroll_of.get(slack_id)
+        if old_scroll is not None:
+            self.ids_of[old_scroll].remove(slack_id)
+
+        self.scroll_of[slack_id] = scroll
+        self.ids_of.setdefault(scroll, []).append(slack_id)
+
+    async def register(self, slack_id: str, scroll: int, overwrite: bool = True) -> bool:
+        """
+        Ties a slack id to a scroll.
+
+        :param overwrite: Whether to replace an existing registration
+        :return: Whether the registration was saved
+        """
+        async with DB_LOCK:
+            if not overwrite and slack_id in self.scroll_of:
+                return False
+
+            with self.db:
+                self.db.execute("INSERT OR REPLACE INTO user_scrolls VALUES (?, ?)", [slack_id, scroll])
+            self._put(slack_id, scroll)
+            return True
+
+
+_index: Optional[_ScrollIndex] = None
+
+
+def _get_index() -> _ScrollIndex:
+    global _index
+    if _index is None:
+        _index = _ScrollIndex()
+    return _index
+
+
 async def identify_callback(event: slack_util.Event, match: Match):
     """
     Sets the users scroll
     """
-    async with DB_LOCK:
-        with shelve.open(DB_NAME) as db:
-            # Get the query
-            query = match.group(1).strip()
+    # Get the query
+    query = match.group(1).strip()
 
-            try:
-                user = event.user.user_id
-                scroll = int(query)
-                db[user] = scroll
-                result = "Updated user {} to have scroll {}".format(user, scroll)
-            except ValueError:
-                result = "Bad scroll: {}".format(query)
+    try:
+        user = event.user.user_id
+        scroll = int(query)
+        await _get_index().register(user, scroll)
+        result = "Updated user {} to have scroll {}".format(user, scroll)
+    except ValueError:
+        result = "Bad scroll: {}".format(query)
 
-            # Respond
-            client.get_slack().reply(event, result)
+    # Respond
+    client.get_slack().reply(event, result)
 
 
 async def identify_other_callback(event: slack_util.Event, match: Match):
     """
     Sets another users scroll
     """
-    async with DB_LOCK:
-        with shelve.open(DB_NAME) as db:
-            # Get the query
-            user = match.group(1).strip()
-            scroll_txt = match.group(2).strip()
+    # Get the query
+    user = match.group(1).strip()
+    scroll_txt = match.group(2).strip()
 
-            try:
-                scroll = int(scroll_txt)
-                if user in db:
-                    result = "To prevent trolling, once a users id has been set only they can change it"
-                else:
-                    db[user] = scroll
-                    result = "Updated user {} to have scroll {}".format(user, scroll)
-            except ValueError:
-                result = "Bad scroll: {}".format(scroll_txt)
+    try:
+        scroll = int(scroll_txt)
+        if await _get_index().register(user, scroll, overwrite=False):
+            result = "Updated user {} to have scroll {}".format(user, scroll)
+        else:
+            result = "To prevent trolling, once a users id has been set only they can change it"
+    except ValueError:
+        result = "Bad scroll: {}".format(scroll_txt)
 
-            # Respond
-            client.get_slack().reply(event, result)
+    # Respond
+    client.get_slack().reply(event, result)
 
 
 # noinspection PyUnusedLocal
@@ -70,15 +147,13 @@ async def check_callback(event: slack_util.Event, match: Match):
     """
     Replies with the users current scroll assignment
     """
-    async with DB_LOCK:
-        # Tells the user their current scroll
-        with shelve.open(DB_NAME) as db:
-            try:
-                scroll = db[event.user.user_id]
-                result = "You are currently registered with scroll {}".format(scroll)
-            except KeyError:
-                result = NON_REG_MSG
-            client.get_slack().reply(event, result)
+    # Tells the user their current scroll
+    scroll = _get_index().scroll_of.get(event.user.user_id)
+    if scroll is not None:
+        result = "You are currently registered with scroll {}".format(scroll)
+    else:
+        result = NON_REG_MSG
+    client.get_slack().reply(event, result)
 
 
 # noinspection PyUnusedLocal
@@ -86,20 +161,18 @@ async def name_callback(event: slack_util.Event, match: Match):
     """
     Tells the user what it thinks the calling users name is.
     """
-    async with DB_LOCK:
-        with shelve.open(DB_NAME) as db:
-            try:
-                scroll = db[event.user.user_id]
-                brother = scroll_util.find_by_scroll(scroll)
-                if brother:
-                    result = "The bot thinks your name is {}".format(brother.name)
-                else:
-                    result = "The bot couldn't find a name for scroll {}".format(scroll)
-            except (KeyError, ValueError):
-                result = NON_REG_MSG
+    scroll = _get_index().scroll_of.get(event.user.user_id)
+    if scroll is not None:
+        brother = scroll_util.find_by_scroll(scroll)
+        if brother:
+            result = "The bot thinks your name is {}".format(brother.name)
+        else:
+            result = "The bot couldn't find a name for scroll {}".format(scroll)
+    else:
+        result = NON_REG_MSG
 
-            # Respond
-            client.get_slack().reply(event, result)
+    # Respond
+    client.get_slack().reply(event, result)
 
 
 async def lookup_slackid_brother(slack_id: str) -> scroll_util.Brother:
@@ -108,14 +181,10 @@ async def lookup_slackid_brother(slack_id: str) -> scroll_util.Brother:
     :raises BrotherNotFound:
     :return: Brother object or None
     """
-    async with DB_LOCK:
-        with shelve.open(DB_NAME) as db:
-            try:
-                scroll = db[slack_id]
-                return scroll_util.find_by_scroll(scroll)
-            except (KeyError, ValueError):
-                raise scroll_util.BrotherNotFound("Slack id {} not tied to brother".format(slack_id))
-    raise scroll_util.BrotherNotFound("Couldn't find an appropriate brother for slackid {}.".format(slack_id))
+    scroll = _get_index().scroll_of.get(slack_id)
+    if scroll is None:
+        raise scroll_util.BrotherNotFound("Slack id {} not tied to brother".format(slack_id))
+    return scroll_util.find_by_scroll(scroll)
 
 
 async def lookup_brother_userids(brother: scroll_util.Brother) -> List[str]:
@@ -125,15 +194,18 @@ async def lookup_brother_userids(brother: scroll_util.Brother) -> List[str]:
     :param brother: Brother to lookup scrolls for
     :return: List of user id strings (may be empty)
     """
-    async with DB_LOCK:
-        with shelve.open(DB_NAME) as db:
-            keys = db.keys()
-            result = []
-            for user_id in keys:
-                if db[user_id] == brother.scroll:
-                    result.append(user_id)
+    return (await lookup_many_brother_userids([brother]))[brother]
+
 
-            return result
+async def lookup_many_brother_userids(brothers: Iterable[scroll_util.Brother]) -> Dict[scroll_util.Brother, List[str]]:
+    """
+    Returns the userids associated with each of the given brothers, all at once.
+
+    :param brothers: Brothers to lookup scrolls for
+    :return: Dict of each brother to their list of user id strings (may be empty)
+    """
+    ids_of = _get_index().ids_of
+    return {brother: list(ids_of.get(brother.scroll, [])) for brother in brothers}
 
 
 identify_hook = hooks.ChannelHook(identify_callback, patterns=r"my scroll is (.*)")
@@ -1,11 +1,13 @@
+import dataclasses
 import logging
-from dataclasses import dataclass
-from typing import List, Match, Callable, TypeVar, Optional, Iterable, Any, Coroutine
+import re
+from dataclasses import dataclass, field
+from typing import List, Match, Callable, TypeVar, Optional, Iterable, Dict, Tuple
 
-from fuzzywuzzy import fuzz
+from rapidfuzz import fuzz
 
 import hooks
-from plugins import identifier, house_management, scroll_util
+from plugins import identifier, house_management, scroll_util, towel_ledger
 import client
 import slack_util
 
@@ -13,20 +15,35 @@ SHEET_ID = "1lPj9GjB00BuIq9GelOWh5GmiGsheLlowPnHLnWBvMOM"
 
 MIN_RATIO = 80.0
 
+# How many brothers to list in standings
+STANDINGS_SIZE = 10
 
-async def alert_user(brother: scroll_util.Brother, saywhat: str) -> None:
+
+async def alert_many(alerts: List[Tuple[scroll_util.Brother, str]]) -> Dict[scroll_util.Brother, bool]:
     """
-    DM a brother saying something. Wrapper around several simpler methods
+    DM several brothers, each with their own message, looking them all up at once and messaging them concurrently.
+    Returns whether each brother was reached with everything meant for them.
     """
-    # We do this as a for loop just in case multiple people reg. to same scroll for some reason (e.g. dup accounts)
-    succ = False
-    for slack_id in await identifier.lookup_brother_userids(brother):
-        client.get_slack().send_message(saywhat, slack_id)
-        succ = True
+    slack_ids = await identifier.lookup_many_brother_userids(brother for brother, _ in alerts)
+
+    # We message every id just in case multiple people reg. to same scroll for some reason (e.g. dup accounts)
+    # Remember which alert each message is for, since a brother may get several alerts
+    messages = [(i, slack_id, saywhat) for i, (brother, saywhat) in enumerate(alerts) for slack_id in slack_ids[brother]]
+    sent = await client.get_slack().send_dms([(slack_id, saywhat) for _, slack_id, saywhat in messages])
+
+    # Each alert got through if any of its messages did
+    delivered = [False] * len(alerts)
+    for (i, _, _), success in zip(messages, sent):
+        delivered[i] = delivered[i] or success
 
     # Warn if we never find
-    if not succ:
-        logging.warning("Unable to find dm conversation for brother {}".format(brother))
+    reached = {}
+    for (brother, _), success in zip(alerts, delivered):
+        reached[brother] = reached.get(brother, True) and success
+    for brother, success in reached.items():
+        if not success:
+            logging.warning("Unable to find dm conversation for brother {}".format(brother))
+    return reached
 
 
 # Generic type
@@ -56,71 +73,179 @@ def tiemax(items: Iterable[T], key: Callable[[T], Optional[float]]) -> List[T]:
 @dataclass
 class _ModJobContext:
     signer: scroll_util.Brother  # The brother invoking the command
+    target: scroll_util.Brother  # The brother the command was aimed at
     assign: house_management.JobAssignment  # The job assignment to modify
 
 
-async def _mod_jobs(event: slack_util.Event,
-                    relevance_scorer: Callable[[house_management.JobAssignment], Optional[float]],
-                    modifier: Callable[[_ModJobContext], Coroutine[Any, Any, None]],
-                    no_job_msg: str = None
-                    ) -> None:
+@dataclass
+class _ModJobResult:
+    summary: str  # What to say about the change in the reply
+    alerts: List[Tuple[scroll_util.Brother, str]] = field(default_factory=list)  # Who to DM about it, and what to say
+
+
+# Separates the targets of a job command. Commas before a suffix, as in "John Doe, Jr.", are part of the name
+target_separator = re.compile(r"\n|,(?!\s*(?:jr|sr|ii|iii|iv)\b)", flags=re.IGNORECASE)
+
+
+def split_targets(text: str) -> List[str]:
     """
-    Stub function that handles various tasks relating to modifying jobs
-    :param relevance_scorer: Function scores job assignments on relevance. Determines which gets modified
-    :param modifier: Callback function to modify a job. Only called on a successful operation, and only on one job
+    Splits the argument of a job command into its targets, which may be separated by commas or newlines.
     """
-    # Make an error wrapper
-    verb = slack_util.VerboseWrapper(event)
+    return [t.strip() for t in target_separator.split(text) if t.strip()]
 
-    # Who invoked this command?
-    signer = await verb(event.user.as_user().get_brother())
 
-    # Get all of the assignments
-    assigns = await verb(house_management.import_assignments())
+def _whole_name_ratio(name: str, brother: scroll_util.Brother) -> float:
+    """
+    Scores how well name matches all of a brothers name, without the partial matching that lets a short name
+    match any longer one containing it.
+    """
+    query = scroll_util.normalise_name(name)
+    full_name = scroll_util.normalise_name(brother.name)
+    return max(fuzz.ratio(query, full_name), fuzz.token_sort_ratio(query, full_name))
+
 
-    # Find closest assignment to what we're after. This just wraps relevance_scorer to handle nones.
-    def none_scorer(a: Optional[house_management.JobAssignment]) -> Optional[float]:
-        if a is None:
-            return None
+async def _resolve_targets(names: List[str]) -> Tuple[List[Optional[scroll_util.Brother]], List[str]]:
+    """
+    Looks up the brothers named in a job command, all at once.
+    When several are named, each must match a whole name. A stray fragment of a mis-split name shouldn't land on
+    some other brother.
+
+    :return: The brother for each name (or None if it couldn't be found), and why each missing one couldn't be found
+    """
+    found = []
+    failures = []
+    for name, (brother, score) in zip(names, await scroll_util.resolve_many(names)):
+        try:
+            brother = scroll_util.check_threshold(name, brother, score, MIN_RATIO)
+        except scroll_util.BrotherNotFound as e:
+            found.append(None)
+            failures.append(str(e))
+            continue
+
+        if len(names) > 1 and _whole_name_ratio(name, brother) <= MIN_RATIO:
+            found.append(None)
+            failures.append("Couldn't find brother {}. It only matches part of the name \"{}\". When naming several "
+                            "brothers, please type each name in full.".format(name, brother.name))
         else:
-            return relevance_scorer(a)
+            found.append(brother)
+    return found, failures
+
+
+def _find_assigns(snapshot: house_management.JobSnapshot,
+                  target: scroll_util.Brother,
+                  predicate: Callable[[house_management.JobAssignment], bool]) -> List[house_management.JobAssignment]:
+    """
+    Finds the assignments of target that satisfy predicate.
+    Assignees are already resolved brothers, so this is just a lookup. We only fall back to fuzzy matching names
+    for assignees that weren't found in the family tree, in which case the best matches are returned.
+    """
+    direct = [a for a in snapshot.by_assignee.get(target, []) if predicate(a)]
+    if direct:
+        return direct
+
+    # Score by name similarity
+    def scorer(assign: house_management.JobAssignment) -> Optional[float]:
+        if predicate(assign):
+            r = round(fuzz.ratio(target.name, assign.assignee.name))
+            if r > MIN_RATIO:
+                return r
 
-    closest_assigns = tiemax(assigns, key=none_scorer)
+    return tiemax(snapshot.unresolved, key=scorer)
 
-    # This is what we do on success. It will or won't be called immediately based on what's in closest_assigns
-    async def success_callback(targ_assign: house_management.JobAssignment) -> None:
-        # First get the most up to date version of the jobs
-        fresh_assigns = await verb(house_management.import_assignments())
 
-        # Find the one that matches what we had before
-        fresh_targ_assign = fresh_assigns[fresh_assigns.index(targ_assign)]
+async def _apply_mods(event: slack_util.Event,
+                      signer: scroll_util.Brother,
+                      chosen: List[Tuple[scroll_util.Brother, house_management.JobAssignment]],
+                      predicate: Callable[[house_management.JobAssignment], bool],
+                      modifier: Callable[[_ModJobContext], _ModJobResult],
+                      notes: List[str]) -> None:
+    """
+    Applies modifier to each chosen (target, assignment) on the current snapshot, then saves the assignments and points
+    once for the lot, and replies with a summary of everything that happened.
+    """
+    verb = slack_util.VerboseWrapper(event)
 
-        # Create the context
-        context = _ModJobContext(signer, fresh_targ_assign)
+    # First get the most up to date version of the jobs
+    fresh_assigns = (await verb(house_management.get_snapshot())).assigns
+
+    # Modify each, remembering how it was so we can rescore just the changed jobs
+    changes = []
+    results = []
+    for target, targ_assign in chosen:
+        # Find the one that matches what we had before, and make sure it still makes sense to modify
+        try:
+            fresh_targ_assign = fresh_assigns[fresh_assigns.index(targ_assign)]
+        except ValueError:
+            fresh_targ_assign = None
+        if fresh_targ_assign is None or not predicate(fresh_targ_assign):
+            notes.append("Job {} changed in the meantime. Try again.".format(targ_assign.job.pretty_fmt()))
+            continue
 
-        # Modify it
-        await modifier(context)
+        before = dataclasses.replace(fresh_targ_assign)
+        results.append(modifier(_ModJobContext(signer, target, fresh_targ_assign)))
+        changes.append((before, fresh_targ_assign))
 
-        # Re-upload
+    # Re-upload, then update points, in one go. Re-uploading also brings the shared snapshot up to date
+    if changes:
         await house_management.export_assignments(fresh_assigns)
+        points = await house_management.import_points()
+        house_management.rescore_house_points(points, changes)
+        house_management.export_points(points)
 
-        # Also import and update points
-        headers, points = await house_management.import_points()
-        house_management.apply_house_points(points, fresh_assigns)
-        house_management.export_points(headers, points)
+    # Say what we did, then tell the people
+    client.get_slack().reply(event, "\n".join([r.summary for r in results] + notes))
+    await alert_many([alert for r in results for alert in r.alerts])
 
-    # If there aren't any jobs, say so
-    if len(closest_assigns) == 0:
-        if no_job_msg is None:
-            no_job_msg = "Unable to find any jobs to apply this command to. Try again with better spelling or whatever."
-        client.get_slack().reply(event, no_job_msg)
 
-    # If theres only one job, sign it off
-    elif len(closest_assigns) == 1:
-        await success_callback(closest_assigns[0])
+async def _mod_jobs(event: slack_util.Event,
+                    targets: List[scroll_util.Brother],
+                    predicate: Callable[[house_management.JobAssignment], bool],
+                    modifier: Callable[[_ModJobContext], _ModJobResult],
+                    notes: List[str],
+                    no_job_msg: str = None
+                    ) -> None:
+    """
+    Stub function that handles various tasks relating to modifying jobs.
+    Every target's job is modified on the same snapshot, and saved in a single write.
+    :param targets: The brothers whose jobs should be modified
+    :param predicate: Function deciding which of a target's job assignments are eligible to be modified
+    :param modifier: Callback function to modify a job. Only called on a successful operation, and only on one job
+                     per target
+    :param notes: Problems found so far (e.g. names that couldn't be found), to report along with the results
+    """
+    # If nobody could be found, there's nothing to do
+    if not targets:
+        client.get_slack().reply(event, "\n".join(notes))
+        return
+
+    # Make an error wrapper
+    verb = slack_util.VerboseWrapper(event)
+
+    # Who invoked this command?
+    signer = await verb(event.user.as_user().get_brother())
+
+    # Get all of the assignments
+    snapshot = await verb(house_management.get_snapshot())
+
+    # Find closest assignment to what we're after, for each target
+    chosen: List[Tuple[scroll_util.Brother, house_management.JobAssignment]] = []
+    ambiguous: List[Tuple[scroll_util.Brother, List[house_management.JobAssignment]]] = []
+    for target in targets:
+        closest_assigns = [a for a in _find_assigns(snapshot, target, predicate)
+                           if not any(a is c for _, c in chosen)]
+        if len(closest_assigns) == 0:
+            # With just the one target, no_job_msg says this already
+            if len(targets) > 1:
+                notes.append("Couldn't find a job for {} to apply this command to.".format(target.name))
+        elif len(closest_assigns) == 1:
+            chosen.append((target, closest_assigns[0]))
+        else:
+            ambiguous.append((target, closest_assigns))
+
+    # If theres just the one target, and it has multiple jobs, we need to get a follow up!
+    if len(targets) == 1 and ambiguous:
+        target, closest_assigns = ambiguous[0]
 
-    # If theres multiple jobs, we need to get a follow up!
-    else:
         # Say we need more info
         job_list = "\n".join("{}: {}".format(i, a.job.pretty_fmt()) for i, a in enumerate(closest_assigns))
         client.get_slack().reply(event, "Multiple relevant job listings found.\n"
@@ -138,7 +263,7 @@ async def _mod_jobs(event: slack_util.Event,
             # Check that its valid
             if 0 <= index < len(closest_assigns):
                 # We now know what we're trying to sign off!
-                await success_callback(closest_assigns[index])
+                await _apply_mods(event, signer, [(target, closest_assigns[index])], predicate, modifier, notes)
             else:
                 # They gave a bad index, or we were unable to find the assignment again.
                 client.get_slack().reply(_event, "Invalid job index / job unable to be found.")
@@ -148,130 +273,143 @@ async def _mod_jobs(event: slack_util.Event,
 
         # Register it
         client.get_slack().add_hook(new_hook)
+        return
 
+    # Otherwise, we can't ask about each one, so skip them
+    for target, closest_assigns in ambiguous:
+        notes.append("Multiple relevant job listings found for {}, so skipped them. "
+                     "Please do them on their own.".format(target.name))
 
-async def signoff_callback(event: slack_util.Event, match: Match) -> None:
-    verb = slack_util.VerboseWrapper(event)
+    # If there aren't any jobs, say so
+    if not chosen:
+        if no_job_msg is None:
+            no_job_msg = "Unable to find any jobs to apply this command to. Try again with better spelling or whatever."
+        client.get_slack().reply(event, "\n".join([no_job_msg] + notes))
+        return
 
-    # Find out who we are trying to sign off is
-    signee_name = match.group(1)
-    signee = await verb(scroll_util.find_by_name(signee_name, MIN_RATIO))
+    await _apply_mods(event, signer, chosen, predicate, modifier, notes)
 
-    # Score by name similarity, only accepting non-assigned jobs
-    def scorer(assign: house_management.JobAssignment):
-        if assign.assignee is not None:
-            r = fuzz.ratio(signee.name, assign.assignee.name)
-            if assign.signer is None and r > MIN_RATIO:
-                return r
+
+async def _mod_named_jobs(event: slack_util.Event,
+                          names: str,
+                          predicate: Callable[[house_management.JobAssignment], bool],
+                          modifier: Callable[[_ModJobContext], _ModJobResult]) -> None:
+    """
+    Runs _mod_jobs for each of the comma/newline separated brother names given.
+    """
+    brothers, notes = await _resolve_targets(split_targets(names))
+
+    # Don't do anyone twice
+    targets = []
+    for brother in brothers:
+        if brother is not None and brother not in targets:
+            targets.append(brother)
+
+    await _mod_jobs(event, targets, predicate, modifier, notes)
+
+
+async def signoff_callback(event: slack_util.Event, match: Match) -> None:
+    # Only accept non-signed-off jobs
+    def predicate(assign: house_management.JobAssignment) -> bool:
+        return assign.signer is None
 
     # Set the assigner, and notify
-    async def modifier(context: _ModJobContext):
+    def modifier(context: _ModJobContext) -> _ModJobResult:
         context.assign.signer = context.signer
 
         # Say we did it wooo!
-        client.get_slack().reply(event, "Signed off {} for {}".format(context.assign.assignee.name,
-                                                                      context.assign.job.name))
-        await alert_user(context.assign.assignee, "{} signed you off for {}.".format(context.assign.signer.name,
-                                                                                     context.assign.job.pretty_fmt()))
+        return _ModJobResult("Signed off {} for {}".format(context.assign.assignee.name,
+                                                           context.assign.job.name),
+                             [(context.assign.assignee,
+                               "{} signed you off for {}.".format(context.assign.signer.name,
+                                                                  context.assign.job.pretty_fmt()))])
 
     # Fire it off
-    await _mod_jobs(event, scorer, modifier)
+    await _mod_named_jobs(event, match.group(1), predicate, modifier)
 
 
 async def undo_callback(event: slack_util.Event, match: Match) -> None:
-    verb = slack_util.VerboseWrapper(event)
-
-    # Find out who we are trying to sign off is
-    signee_name = match.group(1)
-    signee = await verb(scroll_util.find_by_name(signee_name, MIN_RATIO))
-
-    # Score by name similarity, only accepting jobs that are signed off
-    def scorer(assign: house_management.JobAssignment):
-        if assign.assignee is not None:
-            r = fuzz.ratio(signee.name, assign.assignee.name)
-            if assign.signer is not None and r > MIN_RATIO:
-                return r
+    # Only accept jobs that are signed off
+    def predicate(assign: house_management.JobAssignment) -> bool:
+        return assign.signer is not None
 
     # Set the assigner to be None, and notify
-    async def modifier(context: _ModJobContext):
+    def modifier(context: _ModJobContext) -> _ModJobResult:
         context.assign.signer = None
 
         # Say we did it wooo!
-        client.get_slack().reply(event, "Undid signoff of {} for {}".format(context.assign.assignee.name,
-                                                                            context.assign.job.name))
-        await alert_user(context.assign.assignee, "{} undid your signoff off for {}.\n"
-                                                  "Must have been a mistake".format(context.assign.signer.name,
-                                                                                    context.assign.job.pretty_fmt()))
+        return _ModJobResult("Undid signoff of {} for {}".format(context.assign.assignee.name,
+                                                                 context.assign.job.name),
+                             [(context.assign.assignee,
+                               "{} undid your signoff off for {}.\n"
+                               "Must have been a mistake".format(context.signer.name,
+                                                                 context.assign.job.pretty_fmt()))])
 
     # Fire it off
-    await _mod_jobs(event, scorer, modifier)
+    await _mod_named_jobs(event, match.group(1), predicate, modifier)
 
 
 async def late_callback(event: slack_util.Event, match: Match) -> None:
-    verb = slack_util.VerboseWrapper(event)
-
-    # Find out who we are trying to sign off is
-    signee_name = match.group(1)
-    signee = await verb(scroll_util.find_by_name(signee_name, MIN_RATIO))
-
-    # Score by name similarity. Don't care if signed off or not
-    def scorer(assign: house_management.JobAssignment):
-        if assign.assignee is not None:
-            r = fuzz.ratio(signee.name, assign.assignee.name)
-            if r > MIN_RATIO:
-                return r
+    # Don't care if signed off or not
+    def predicate(assign: house_management.JobAssignment) -> bool:
+        return True
 
     # Just set the assigner
-    async def modifier(context: _ModJobContext):
+    def modifier(context: _ModJobContext) -> _ModJobResult:
         context.assign.late = not context.assign.late
 
         # Say we did it
-        client.get_slack().reply(event, "Toggled lateness of {}.\n"
-                                              "Now marked as late: {}".format(context.assign.job.pretty_fmt(),
-                                                                              context.assign.late))
+        return _ModJobResult("Toggled lateness of {}.\n"
+                             "Now marked as late: {}".format(context.assign.job.pretty_fmt(),
+                                                             context.assign.late))
 
     # Fire it off
-    await _mod_jobs(event, scorer, modifier)
+    await _mod_named_jobs(event, match.group(1), predicate, modifier)
+
+
+reassign_pair_pattern = re.compile(r"(.*?)\s*-&gt;\s*(.+)")
 
 
 async def reassign_callback(event: slack_util.Event, match: Match) -> None:
-    verb = slack_util.VerboseWrapper(event)
+    # Find out our pairs of targets
+    pairs = []
+    notes = []
+    for piece in split_targets(match.group(1)):
+        pair_match = reassign_pair_pattern.fullmatch(piece)
+        if pair_match:
+            pairs.append((pair_match.group(1).strip(), pair_match.group(2).strip()))
+        else:
+            notes.append("Couldn't understand \"{}\". Reassignments look like \"from -> to\".".format(piece))
 
-    # Find out our two targets
-    from_name = match.group(1).strip()
-    to_name = match.group(2).strip()
+    # Get them as brothers, all at once
+    names = [from_name for from_name, _ in pairs] + [to_name for _, to_name in pairs]
+    brothers, failures = await _resolve_targets(names)
+    notes += failures
 
-    # Get them as brothers
-    from_bro = await verb(scroll_util.find_by_name(from_name, MIN_RATIO))
-    to_bro = await verb(scroll_util.find_by_name(to_name, MIN_RATIO))
+    # Figure out where each brother's job is going. Don't do anyone twice
+    to_of: Dict[scroll_util.Brother, scroll_util.Brother] = {}
+    for from_bro, to_bro in zip(brothers[:len(pairs)], brothers[len(pairs):]):
+        if from_bro is not None and to_bro is not None:
+            to_of.setdefault(from_bro, to_bro)
 
-    # Score by name similarity to the first brother. Don't care if signed off or not,
-    # as we want to be able to transfer even after signoffs (why not, amirite?)
-    def scorer(assign: house_management.JobAssignment):
-        if assign.assignee is not None:
-            r = fuzz.ratio(from_bro.name, assign.assignee.name)
-            if r > MIN_RATIO:
-                return r
+    # Don't care if signed off or not, as we want to be able to transfer even after signoffs (why not, amirite?)
+    def predicate(assign: house_management.JobAssignment) -> bool:
+        return True
 
     # Change the assignee
-    async def modifier(context: _ModJobContext):
+    def modifier(context: _ModJobContext) -> _ModJobResult:
+        from_bro = context.target
+        to_bro = to_of[from_bro]
         context.assign.assignee = to_bro
 
-        # Say we did it
-        reassign_msg = "Job {} reassigned from {} to {}".format(context.assign.job.pretty_fmt(),
-                                                                from_bro,
-                                                                to_bro)
-        client.get_slack().reply(event, reassign_msg)
-
-        # Tell the people
+        # Say we did it, and tell the people
         reassign_msg = "Job {} reassigned from {} to {}".format(context.assign.job.pretty_fmt(),
                                                                 from_bro,
                                                                 to_bro)
-        await alert_user(from_bro, reassign_msg)
-        await alert_user(to_bro, reassign_msg)
+        return _ModJobResult(reassign_msg, [(from_bro, reassign_msg), (to_bro, reassign_msg)])
 
     # Fire it off
-    await _mod_jobs(event, scorer, modifier)
+    await _mod_jobs(event, list(to_of), predicate, modifier, notes)
 
 
 # noinspection PyUnusedLocal
@@ -280,34 +418,75 @@ async def reset_callback(event: slack_util.Event, match: Match) -> None:
     Resets the scores.
     """
     # Unassign everything
-    assigns = await house_management.import_assignments()
+    assigns = (await house_management.get_snapshot()).assigns
     for a in assigns:
         if a is not None:
             a.signer = None
     await house_management.export_assignments(assigns)
 
-    # Now wipe points
-    headers, points = house_management.import_points()
+    # Now wipe points, keeping a record of the week that was
+    points = await house_management.import_points()
+    house_management.archive_points(points)
+    (await towel_ledger.get_ledger()).start_period()
 
     # Set to 0/default
-    for i in range(len(points)):
-        new = house_management.PointStatus(brother=points[i].brother)
-        points[i] = new
+    points.reset()
 
-    house_management.apply_house_points(points, await house_management.import_assignments())
-    house_management.export_points(headers, points)
+    house_management.apply_house_points(points, assigns)
+    house_management.export_points(points)
 
     client.get_slack().reply(event, "Reset scores and signoffs")
 
 
 # noinspection PyUnusedLocal
 async def refresh_callback(event: slack_util.Event, match: Match) -> None:
-    headers, points = await house_management.import_points()
-    house_management.apply_house_points(points, await house_management.import_assignments())
-    house_management.export_points(headers, points)
+    # Don't trust anything we had already
+    house_management.invalidate_snapshot()
+
+    await house_management.recompute_house_points()
     client.get_slack().reply(event, "Force updated point values")
 
 
+# noinspection PyUnusedLocal
+async def point_history_callback(event: slack_util.Event, match: Match) -> None:
+    verb = slack_util.VerboseWrapper(event)
+
+    # Who wants to know?
+    brother = await verb(event.user.as_user().get_brother())
+
+    # Get their archived weeks
+    trend = house_management.point_trend(brother)
+    if trend:
+        history = "\n".join("{}: {}".format(week, round(total, 2)) for week, total in trend)
+        client.get_slack().reply(event, "Point history for {}:\n{}".format(brother.name, history))
+    else:
+        client.get_slack().reply(event, "No point history recorded for {} yet".format(brother.name))
+
+
+# noinspection PyUnusedLocal
+async def standings_callback(event: slack_util.Event, match: Match) -> None:
+    points = await house_management.import_points()
+    totals = points.totals()
+
+    # Best first, skipping blank rows
+    ranked = sorted(((b.name, float(totals[i])) for i, b in enumerate(points.brothers) if b is not None),
+                    key=lambda nt: -nt[1])
+    lines = ["{}. {}: {}".format(place, name, round(total, 2))
+             for place, (name, total) in enumerate(ranked[:STANDINGS_SIZE], 1)]
+    client.get_slack().reply(event, "Point standings this week:\n{}".format("\n".join(lines)))
+
+
+# noinspection PyUnusedLocal
+async def week_standings_callback(event: slack_util.Event, match: Match) -> None:
+    standings = house_management.week_standings()
+    if standings:
+        lines = ["{}. {}: {}".format(place, name, round(total, 2))
+                 for place, (name, total) in enumerate(standings[:STANDINGS_SIZE], 1)]
+        client.get_slack().reply(event, "Archived point standings for this week:\n{}".format("\n".join(lines)))
+    else:
+        client.get_slack().reply(event, "No points archived for this week yet")
+
+
 async def nag_callback(event: slack_util.Event, match: Match) -> None:
     # Get the day
     day = match.group(1).lower().strip()
@@ -320,11 +499,8 @@ async def nag_callback(event: slack_util.Event, match: Match) -> None:
 
 # Wrapper so we can auto-call this as well
 async def nag_jobs(day_of_week: str) -> bool:
-    # Get the assigns
-    assigns = await house_management.import_assignments()
-
-    # Filter to day
-    assigns = [assign for assign in assigns if assign is not None and assign.job.day_of_week.lower() == day_of_week]
+    # Get the assigns for the day
+    assigns = await house_management.query_assignments(day_of_week=day_of_week)
 
     # Filter signed off
     assigns = [assign for assign in assigns if assign.signer is None]
@@ -333,6 +509,9 @@ async def nag_jobs(day_of_week: str) -> bool:
     if not assigns:
         return False
 
+    # Find the people to @, all at once
+    slack_ids = await identifier.lookup_many_brother_userids(a.assignee for a in assigns if a.assignee is not None)
+
     # Nag each
     response = "Do yer jerbs! They are as follows:\n"
     for assign in assigns:
@@ -341,8 +520,7 @@ async def nag_jobs(day_of_week: str) -> bool:
             continue
         response += "({}) {} -- {} ".format(assign.job.house, assign.job.name, assign.assignee.name)
 
-        # Find the people to @
-        brother_slack_ids = await identifier.lookup_brother_userids(assign.assignee)
+        brother_slack_ids = slack_ids[assign.assignee]
 
         if brother_slack_ids:
             for slack_id in brother_slack_ids:
@@ -358,23 +536,23 @@ async def nag_jobs(day_of_week: str) -> bool:
 
 signoff_hook = hooks.ChannelHook(signoff_callback,
                                  patterns=[
-                                         r"signoff\s+(.*)",
-                                         r"sign off\s+(.*)",
+                                         r"signoff\s+([\s\S]*)",
+                                         r"sign off\s+([\s\S]*)",
                                      ],
                                  channel_whitelist=["#housejobs"])
 
 undo_hook = hooks.ChannelHook(undo_callback,
                               patterns=[
-                                      r"unsignoff\s+(.*)",
-                                      r"undosignoff\s+(.*)",
-                                      r"undo signoff\s+(.*)",
+                                      r"unsignoff\s+([\s\S]*)",
+                                      r"undosignoff\s+([\s\S]*)",
+                                      r"undo signoff\s+([\s\S]*)",
                                   ],
                               channel_whitelist=["#housejobs"])
 
 late_hook = hooks.ChannelHook(late_callback,
                               patterns=[
-                                      r"marklate\s+(.*)",
-                                      r"mark late\s+(.*)",
+                                      r"marklate\s+([\s\S]*)",
+                                      r"mark late\s+([\s\S]*)",
                                   ],
                               channel_whitelist=["#housejobs"])
 
@@ -393,7 +571,7 @@ nag_hook = hooks.ChannelHook(nag_callback,
                              channel_whitelist=["#command-center"])
 
 reassign_hook = hooks.ChannelHook(reassign_callback,
-                                  patterns=r"reassign\s+(.*?)-&gt;\s+(.+)",
+                                  patterns=r"reassign\s+([\s\S]*?-&gt;[\s\S]+)",
                                   channel_whitelist=["#housejobs"])
 
 refresh_hook = hooks.ChannelHook(refresh_callback,
@@ -403,6 +581,24 @@ refresh_hook = hooks.ChannelHook(refresh_callback,
                                      ],
                                  channel_whitelist=["#command-center"])
 
+point_history_hook = hooks.ChannelHook(point_history_callback,
+                                       patterns=[
+                                           r"point history",
+                                           r"my point history",
+                                       ])
+
+standings_hook = hooks.ChannelHook(standings_callback,
+                                   patterns=[
+                                       r"standings",
+                                       r"point standings",
+                                   ])
+
+week_standings_hook = hooks.ChannelHook(week_standings_callback,
+                                        patterns=[
+                                            r"week standings",
+                                            r"archived standings",
+                                        ])
+
 block_action = """
 [
 	{
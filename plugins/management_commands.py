@@ -2,8 +2,11 @@ from typing import Match
 
 import hooks
 import client
+import diagnostics
+import scheduler
 import settings
 import slack_util
+from plugins import scroll_util
 
 
 # Gracefully reboot to reload code changes
@@ -57,6 +60,43 @@ async def post_log_callback(event: slack_util.Event, match: Match) -> None:
         client.get_slack().reply(event, "```" + ''.join(lines) + "```")
 
 
+# noinspection PyUnusedLocal
+async def cache_stats_callback(event: slack_util.Event, match: Match) -> None:
+    client.get_slack().reply(event, scroll_util.name_cache_stats())
+
+
+# noinspection PyUnusedLocal
+async def schedule_stats_callback(event: slack_util.Event, match: Match) -> None:
+    client.get_slack().reply(event, scheduler.get_scheduler().describe())
+
+
+# noinspection PyUnusedLocal
+async def passive_stats_callback(event: slack_util.Event, match: Match) -> None:
+    client.get_slack().reply(event, client.get_slack().describe_passives())
+
+
+# noinspection PyUnusedLocal
+async def lag_report_callback(event: slack_util.Event, match: Match) -> None:
+    client.get_slack().reply(event, diagnostics.get_watchdog().report())
+
+
+async def profile_callback(event: slack_util.Event, match: Match) -> None:
+    seconds = int(match.group(1) or 30)
+    if seconds > diagnostics.PROFILE_MAX_SECONDS:
+        client.get_slack().reply(event, "Can profile for at most {}s".format(diagnostics.PROFILE_MAX_SECONDS))
+        return
+    client.get_slack().reply(event, "Profiling for {}s...".format(seconds))
+
+    report = await diagnostics.profile(seconds)
+    if report is None:
+        client.get_slack().reply(event, "Already profiling. Try again once that's done")
+        return
+    client.get_slack().upload_snippet(report,
+                                      "Profile of {}s".format(seconds),
+                                      event.conversation.conversation_id,
+                                      thread=event.message.ts)
+
+
 # Make hooks
 reboot_hook = hooks.ChannelHook(reboot_callback,
                                 patterns=r"reboot",
@@ -65,3 +105,23 @@ reboot_hook = hooks.ChannelHook(reboot_callback,
 log_hook = hooks.ChannelHook(post_log_callback,
                              patterns=["post logs(.*)", "logs(.*)", "post_logs(.*)"],
                              channel_whitelist=["#botzone"])
+
+cache_stats_hook = hooks.ChannelHook(cache_stats_callback,
+                                     patterns=["cache stats"],
+                                     channel_whitelist=["#botzone"])
+
+schedule_stats_hook = hooks.ChannelHook(schedule_stats_callback,
+                                        patterns=["schedule stats"],
+                                        channel_whitelist=["#botzone"])
+
+passive_stats_hook = hooks.ChannelHook(passive_stats_callback,
+                                       patterns=["passive stats"],
+                                       channel_whitelist=["#botzone"])
+
+lag_report_hook = hooks.ChannelHook(lag_report_callback,
+                                    patterns=["lag report"],
+                                    channel_whitelist=["#botzone"])
+
+profile_hook = hooks.ChannelHook(profile_callback,
+                                 patterns=[r"profile(?:\s+(\d+)\s*s?)?"],
+                                 channel_whitelist=["#command-center"])
@@ -1,45 +1,19 @@
 import asyncio
 import logging
-from datetime import datetime, timedelta
 from typing import Optional, List
 
 import hooks
+import scheduler
 import slack_util
-from plugins import identifier, job_commands, house_management
+from plugins import identifier, job_commands, house_management, house_store, scroll_util, towel_ledger
 import client
 
 
-def seconds_until(target: datetime) -> float:
-    curr = datetime.now()
-
-    # Compute seconds betwixt
-    delta = target - curr
-    ds = delta.seconds
-
-    # Lower bound to 0
-    if ds < 0:
-        return 0
-    else:
-        return delta.seconds
-
-
-class ItsTenPM(hooks.Passive):
-    async def run(self) -> None:
-        while True:
-            # Get 10PM
-            ten_pm = datetime.now().replace(hour=22, minute=0, second=0)
-
-            # Find out how long until it, then sleep that long
-            delay = seconds_until(ten_pm)
-            await asyncio.sleep(delay)
-
-            # Crow like a rooster
-            client.get_slack().send_message("IT'S 10 PM!", client
-                                            .get_slack()
-                                            .get_conversation_by_name("#random").id)
-
-            # Wait a while before trying it again, to prevent duplicates
-            await asyncio.sleep(60)
+async def its_ten_pm() -> None:
+    # Crow like a rooster
+    client.get_slack().send_message("IT'S 10 PM!", client
+                                    .get_slack()
+                                    .get_conversation_by_name("#random").id)
 
 
 # Shared behaviour
@@ -63,7 +37,7 @@ class JobNotifier:
         if a is None:
             return False
         # If its not today, we shouldn't nag
-        if a.job.day_of_week.lower() != JobNotifier.get_day_of_week(datetime.now()).lower():
+        if a.job.day_of_week.lower() != JobNotifier.get_day_of_week(scheduler.now()).lower():
             return False
         # If it is unassigned, we can't nag
         if a.assignee is None:
@@ -77,84 +51,108 @@ class JobNotifier:
         return True
 
 
-class NotifyJobs(hooks.Passive, JobNotifier):
-    # Auto-does the nag jobs thing
-    async def run(self) -> None:
-        while True:
-            # Get the "Start" of the current day (Say, 10AM)
-            next_remind_time = datetime.now().replace(hour=10, minute=00, second=0)
+async def notify_jobs() -> None:
+    """
+    Auto-does the nag jobs thing. Scheduled for the "Start" of the day (Say, 10AM)
+    """
+    await job_commands.nag_jobs(JobNotifier.get_day_of_week(scheduler.now()))
 
-            # If we've accidentally made it in the past somehow, bump it up one date
-            while datetime.now() > next_remind_time:
-                next_remind_time += timedelta(days=1)
 
-            # Sleep until that time
-            delay = seconds_until(next_remind_time)
-            await asyncio.sleep(delay)
+async def remind_jobs() -> None:
+    """
+    DMs everyone who hasn't done their job yet. Scheduled for the end of the day (Say, 10PM)
+    """
+    # Get the current jobs
+    assigns = await house_management.query_assignments(day_of_week=JobNotifier.get_day_of_week(scheduler.now()))
 
-            # Now it is that time. Nag the jobs
-            await job_commands.nag_jobs(self.get_day_of_week(next_remind_time))
+    # Filter to incomplete, and today
+    assigns: List[house_management.JobAssignment] = [a for a in assigns if JobNotifier.is_job_valid(a)]
 
-            # Sleep for a bit to prevent double shots
-            await asyncio.sleep(10)
+    # Now, we want to nag each person. If we don't actually know who they are, so be it.
+    logging.info("Scheduled reminding people who haven't yet done their jobs.")
+    slack_ids = await identifier.lookup_many_brother_userids(a.assignee for a in assigns)
 
+    # For each, send them a DM. All at once
+    messages = []
+    for i, a in enumerate(assigns):
+        msg = "{}, you still need to do {}".format(a.assignee.name, a.job.pretty_fmt())
+        messages += [(i, slack_id, msg) for slack_id in slack_ids[a.assignee]]
+    sent = await client.get_slack().send_dms([(slack_id, msg) for _, slack_id, msg in messages])
 
-class RemindJobs(hooks.Passive, JobNotifier):
-    async def run(self) -> None:
-        while True:
-            # Get the end of the current day (Say, 10PM)
-            next_remind_time = datetime.now().replace(hour=22, minute=00, second=0)
+    # Warn on failure
+    nagged = set(i for (i, _, _), success in zip(messages, sent) if success)
+    for i, a in enumerate(assigns):
+        if i not in nagged:
+            logging.warning("Tried to nag {} but couldn't find their slack id".format(a.assignee.name))
 
-            # If we've accidentally made it in the past somehow, bump it up one date
-            while datetime.now() > next_remind_time:
-                next_remind_time += timedelta(days=1)
 
-            # Sleep until that time
-            delay = seconds_until(next_remind_time)
-            await asyncio.sleep(delay)
+async def update_slack_caches() -> None:
+    """
+    Updates the channels and users in the slack
+    """
+    client.get_slack().update_channels()
+    client.get_slack().update_users()
 
-            # Now it is that time. Get the current jobs
-            assigns = await house_management.import_assignments()
 
-            # Filter to incomplete, and today
-            assigns: List[house_management.JobAssignment] = [a for a in assigns if self.is_job_valid(a)]
+async def reload_family_tree() -> None:
+    """
+    Reloads the family tree whenever its file changes, so new pledge classes don't need a reboot.
+    """
+    if await scroll_util.reload_family_tree_if_changed():
+        logging.info("Reloaded family tree")
+
 
-            # Now, we want to nag each person. If we don't actually know who they are, so be it.
-            logging.info("Scheduled reminding people who haven't yet done their jobs.")
-            for a in assigns:
-                # Get the relevant slack ids
-                assignee_ids = await identifier.lookup_brother_userids(a.assignee)
+def schedule_periodicals(sched: scheduler.Scheduler) -> None:
+    """
+    Registers all of the timed jobs with the scheduler.
+    Nags and reminders will still go out if we were down at the time, so long as we're back within the hour.
+    """
+    # Add boozebot
+    # sched.add("its_ten_pm", scheduler.Cron("0 22 * * *"), its_ten_pm)
 
-                # For each, send them a DM
-                success = False
-                for slack_id in assignee_ids:
-                    msg = "{}, you still need to do {}".format(a.assignee.name, a.job.pretty_fmt())
-                    success = True
-                    client.get_slack().send_message(msg, slack_id)
+    # Add automatic updating of users
+    sched.add("update_slack_caches", scheduler.Interval(120), update_slack_caches, jitter=10, run_at_start=True)
 
-                # Warn on failure
-                if not success:
-                    logging.warning("Tried to nag {} but couldn't find their slack id".format(a.assignee.name))
+    # Pick up family tree edits
+    sched.add("reload_family_tree", scheduler.Interval(30), reload_family_tree, jitter=5)
 
-            # Take a break to ensure no double-shots
-            await asyncio.sleep(10)
+    # Add nagloop
+    sched.add("notify_jobs", scheduler.Cron("0 10 * * *"), notify_jobs, catch_up=3600)
+    sched.add("remind_jobs", scheduler.Cron("0 22 * * *"), remind_jobs, catch_up=3600)
 
 
-class Updatinator(hooks.Passive):
+class SheetMirror(hooks.Passive):
     """
-    Periodically updates the channels and users in the slack
+    Keeps the house job/point sheet in sync with the local store, in both directions.
     """
 
-    def __init__(self, wrapper_to_update: client.ClientWrapper, interval_seconds: int):
-        self.wrapper_target = wrapper_to_update
+    def __init__(self, interval_seconds: int):
         self.interval = interval_seconds
 
-    async def run(self):
-        # Give time to warmup
+    async def run(self) -> None:
         while True:
-            self.wrapper_target.update_channels()
-            self.wrapper_target.update_users()
-            await asyncio.sleep(self.interval)
+            try:
+                pulled = await asyncio.get_running_loop().run_in_executor(None, house_store.sync_all)
+
+                # Whoever edited the sheet won't have fixed up the points to match
+                if pulled:
+                    await house_management.recompute_house_points()
+            except Exception:
+                # Sheets being down shouldn't stop anything else. We'll catch up next time
+                logging.exception("Failed to sync house store with sheets")
+
+            # Wait until either someone wrote something, or the interval is up
+            await house_store.wait_for_sync_request(self.interval)
+
+
+class LoadTowelLedger(hooks.Passive):
+    """
+    Loads the towel ledger at startup, seeding it from the point sheet if this is the first time ever.
+    If the sheet can't be read, crashes and is retried.
+    """
+
+    async def run(self) -> None:
+        await towel_ledger.get_ledger()
 
 
 class TestPassive(hooks.Passive):
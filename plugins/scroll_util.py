@@ -5,11 +5,14 @@ This file contains util for scroll polling
 Only really kept separate for neatness sake.
 """
 
+import asyncio
+import os
 import re
-from dataclasses import dataclass
-from typing import List, Optional, Match
+from collections import Counter, OrderedDict
+from typing import List, Optional, Match, Callable, Tuple, Dict, Set
 
-from fuzzywuzzy import process
+import numpy as np
+from rapidfuzz import fuzz, process, utils
 
 import hooks
 import client
@@ -18,27 +21,228 @@ import slack_util
 # Use this if we can't figure out who a brother actually is
 MISSINGBRO_SCROLL = -1
 
+# How many distinct fuzzy name queries to remember
+NAME_CACHE_SIZE = 256
+
 
-@dataclass
 class Brother(object):
     """
     Represents a brother.
+    Brothers are interned: there is only ever one object per brother, so equality is identity.
+    Get them from the registry (or missing_brother), rather than constructing them directly.
     """
-    name: str
-    scroll: int
+    __slots__ = ["name", "scroll"]
+
+    def __init__(self, name: str, scroll: int):
+        self.name = name
+        self.scroll = scroll
+
+    def __repr__(self) -> str:
+        return "Brother(name={!r}, scroll={!r})".format(self.name, self.scroll)
 
     def is_valid(self):
-        return self.scroll is not MISSINGBRO_SCROLL
+        return self.scroll != MISSINGBRO_SCROLL
 
 
-# load the family tree
-familyfile = open("sortedfamilytree.txt", 'r')
+FAMILY_TREE_FILE = "sortedfamilytree.txt"
 
-# Parse out
 brother_match = re.compile(r"([0-9]*)~(.*)")
-brothers_matches = [brother_match.match(line) for line in familyfile]
-brothers_matches = [m for m in brothers_matches if m]
-brothers: List[Brother] = [Brother(m.group(2), int(m.group(1))) for m in brothers_matches]
+
+
+
+def _trigrams(processed_name: str) -> Set[str]:
+    padded = "  {} ".format(processed_name)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex(object):
+    """
+    Fuzzy search index over brother names, built once per family tree load.
+    Every lookup scores every name, so results are exactly those of a full scan. For single lookups, trigram postings
+    pick out a few likely candidates first. The best of those sets a score cutoff, which lets the full scan skip
+    names that can't beat it.
+    """
+    # How many trigram candidates to score
+    CANDIDATES = 32
+
+    def __init__(self, names: List[str]):
+        self.names = [utils.default_process(n) for n in names]
+        self.postings: Dict[str, List[int]] = {}
+        for i, name in enumerate(self.names):
+            for trigram in _trigrams(name):
+                self.postings.setdefault(trigram, []).append(i)
+
+    def candidates(self, query: str) -> List[int]:
+        """
+        Gets the indices of the names sharing the most trigrams with a (processed) query, in index order.
+        """
+        shared = Counter()
+        for trigram in _trigrams(query):
+            shared.update(self.postings.get(trigram, ()))
+        return sorted(i for i, _ in shared.most_common(self.CANDIDATES))
+
+    def _score_cutoff(self, query: str) -> float:
+        """
+        Gets a score that the best match for a (processed) query is sure to reach, from its trigram candidates.
+        """
+        candidates = self.candidates(query)
+        if not candidates:
+            return 0
+        scores = process.cdist([query], [self.names[i] for i in candidates],
+                               scorer=fuzz.WRatio, processor=None, dtype=np.float64)[0]
+
+        # Anything that rounds to the candidates' best could still tie with it
+        return max(float(np.round(scores).max()) - 0.5, 0)
+
+    def _best(self, queries: List[str], score_cutoff: float) -> List[Tuple[int, int]]:
+        """
+        Scores (processed) queries against every name. Scores below the cutoff count as 0.
+        """
+        # Rows are queries, columns are names. Ratios are compared as integers, so round first. Then argmax gives
+        # ties to the earliest name. Only worth spreading over threads for several queries
+        scores = np.round(process.cdist(queries, self.names, scorer=fuzz.WRatio, processor=None, dtype=np.float64,
+                                        score_cutoff=score_cutoff, workers=-1 if len(queries) > 1 else 1))
+        best = np.argmax(scores, axis=1)
+        return [(int(i), int(scores[row, i])) for row, i in enumerate(best)]
+
+    def best_match(self, query: str) -> Tuple[int, int]:
+        """
+        Finds the best matching name. Ties go to the earliest name.
+
+        :return: The index of the best match, and its (integer) match ratio
+        """
+        query = utils.default_process(query)
+
+        # Nothing left to match on. Everything scores 0, so the first name wins
+        if not query:
+            return 0, 0
+
+        return self._best([query], self._score_cutoff(query))[0]
+
+    def best_matches(self, queries: List[str]) -> List[Tuple[int, int]]:
+        """
+        Finds the best matching name for each query, as best_match would, in a single similarity matrix.
+        """
+        if not queries:
+            return []
+        return self._best([utils.default_process(q) for q in queries], 0)
+
+
+def normalise_name(name: str) -> str:
+    """
+    Normalises a name for exact lookups. Two names normalising the same have a fuzzy match ratio of 100.
+    """
+    return utils.default_process(name)
+
+
+class BrotherRegistry(object):
+    """
+    Holds the one Brother object for each entry in the family tree, along with lookups over them.
+    """
+
+    def __init__(self, brothers: List[Brother]):
+        self.brothers = brothers
+        self.name_index = NameIndex([b.name for b in brothers])
+
+        # Where there are duplicates, the first entry wins, as it would in a fuzzy search
+        self.by_scroll: Dict[int, Brother] = {}
+        self.by_name: Dict[str, Brother] = {}
+        for b in brothers:
+            self.by_scroll.setdefault(b.scroll, b)
+            self.by_name.setdefault(normalise_name(b.name), b)
+
+
+_registry = BrotherRegistry([])
+
+# When the family tree file was last modified, as of our last load
+_loaded_mtime: Optional[int] = None
+
+# Dummy brothers for names we couldn't find in the family tree, interned by name
+_missing_brothers: Dict[str, Brother] = {}
+
+
+def missing_brother(name: str) -> Brother:
+    """
+    Gets the dummy brother to use for a name that isn't in the family tree.
+    """
+    b = _missing_brothers.get(name)
+    if b is None:
+        b = _missing_brothers[name] = Brother(name, MISSINGBRO_SCROLL)
+    return b
+
+# Things to call whenever the family tree is (re)loaded, such as cache clears
+_reload_listeners: List[Callable[[], None]] = []
+
+
+def add_reload_listener(listener: Callable[[], None]) -> None:
+    """
+    Registers a function to call whenever the family tree is reloaded.
+    Use this to invalidate anything derived from the brothers list.
+    """
+    _reload_listeners.append(listener)
+
+
+def _parse_family_tree(previous: BrotherRegistry) -> Tuple[BrotherRegistry, int]:
+    """
+    Parses the family tree file into a new registry. Blocking, so reloads run this in an executor.
+    Brothers whose entries haven't changed keep their existing objects, so that identity comparisons survive a reload.
+
+    :return: The new registry, and the mtime of the file it was read from
+    """
+    mtime = os.stat(FAMILY_TREE_FILE).st_mtime_ns
+
+    # Parse out
+    with open(FAMILY_TREE_FILE, 'r') as familyfile:
+        brothers_matches = [brother_match.match(line) for line in familyfile]
+    brothers_matches = [m for m in brothers_matches if m]
+
+    # Reuse what we can
+    existing = {(b.scroll, b.name): b for b in previous.brothers}
+    brothers = []
+    for m in brothers_matches:
+        name, scroll = m.group(2), int(m.group(1))
+        brothers.append(existing.get((scroll, name)) or Brother(name, scroll))
+
+    return BrotherRegistry(brothers), mtime
+
+
+def _install_registry(registry: BrotherRegistry, mtime: int) -> None:
+    """
+    Swaps in a new registry, and notifies listeners.
+    """
+    global _registry, _loaded_mtime
+    _registry = registry
+    _loaded_mtime = mtime
+
+    for listener in _reload_listeners:
+        listener()
+
+
+def load_family_tree() -> None:
+    """
+    (Re)loads the family tree from disk, and notifies listeners.
+    """
+    _install_registry(*_parse_family_tree(_registry))
+
+
+async def reload_family_tree_if_changed() -> bool:
+    """
+    Reloads the family tree if the file has been modified since it was last loaded.
+    Parsing happens off the event loop; the new brothers are swapped in all at once.
+
+    :return: Whether a reload happened
+    """
+    loop = asyncio.get_running_loop()
+    mtime = (await loop.run_in_executor(None, os.stat, FAMILY_TREE_FILE)).st_mtime_ns
+    if mtime == _loaded_mtime:
+        return False
+
+    _install_registry(*await loop.run_in_executor(None, _parse_family_tree, _registry))
+    return True
+
+
+# load the family tree
+load_family_tree()
 
 
 async def scroll_callback(event: slack_util.Event, match: Match) -> None:
@@ -63,6 +267,13 @@ async def scroll_callback(event: slack_util.Event, match: Match) -> None:
     client.get_slack().reply(event, result)
 
 
+def all_brothers() -> List[Brother]:
+    """
+    Gets every brother in the family tree, in file order.
+    """
+    return list(_registry.brothers)
+
+
 def find_by_scroll(scroll: int) -> Optional[Brother]:
     """
     Lookups a brother in the family list, using their scroll.
@@ -70,10 +281,16 @@ def find_by_scroll(scroll: int) -> Optional[Brother]:
     :param scroll: The integer scroll to look up
     :return: The brother, or None
     """
-    for b in brothers:
-        if b.scroll == scroll:
-            return b
-    return None
+    return _registry.by_scroll.get(scroll)
+
+
+def find_by_exact_name(name: str) -> Optional[Brother]:
+    """
+    Lookups a brother in the family list, using their exact name (ignoring case, punctuation and spacing).
+
+    :return: The brother, or None
+    """
+    return _registry.by_name.get(normalise_name(name))
 
 
 # Used to track a sufficiently shitty typed name
@@ -82,21 +299,89 @@ class BrotherNotFound(Exception):
     pass
 
 
-async def find_by_name(name: str, threshold: Optional[float] = None) -> Brother:
+async def find_by_name_scored(name: str) -> Tuple[Brother, float]:
     """
-    Looks up a brother by name. Raises exception if threshold provided and not met.
+    Looks up a brother by name, with a fuzzy search.
 
-    :param threshold: Minimum match ratio to accept. Can be none.
-    :param name: The name to look up, with a fuzzy search
-    :raises BrotherNotFound:
-    :return: The best-match brother
-    """    # Get all of the names
-    all_names = [b.name for b in brothers]
+    :param name: The name to look up
+    :return: The best-match brother, and the match ratio
+    """
+    # Exact matches don't need a fuzzy search
+    exact = find_by_exact_name(name)
+    if exact is not None:
+        return exact, 100
+
+    return _cached_best_match(normalise_name(name))
+
+
+class _MatchCache(object):
+    """
+    Remembers fuzzy search results by normalised name, dropping the least recently used once full.
+    People type the same few names over and over, so results are kept until the family tree reloads.
+    Thresholds are applied afterwards, so one entry serves every threshold.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries: OrderedDict[str, Tuple[Brother, int]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, normalised_name: str) -> Optional[Tuple[Brother, int]]:
+        found = self.entries.get(normalised_name)
+        if found is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(normalised_name)
+        return found
+
+    def put(self, normalised_name: str, found: Tuple[Brother, int]) -> None:
+        self.entries[normalised_name] = found
+        self.entries.move_to_end(normalised_name)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+_match_cache = _MatchCache(NAME_CACHE_SIZE)
+add_reload_listener(_match_cache.clear)
 
-    # Do fuzzy match
-    found, score = process.extractOne(name, all_names)
-    found_index = all_names.index(found)
-    found_brother = brothers[found_index]
+
+def _cached_best_match(normalised_name: str) -> Tuple[Brother, int]:
+    """
+    Fuzzy searches the family tree, going through the cache.
+    """
+    found = _match_cache.get(normalised_name)
+    if found is None:
+        found_index, score = _registry.name_index.best_match(normalised_name)
+        found = _registry.brothers[found_index], score
+        _match_cache.put(normalised_name, found)
+    return found
+
+
+def name_cache_stats() -> str:
+    """
+    Describes how well the fuzzy search cache is doing.
+    """
+    lookups = _match_cache.hits + _match_cache.misses
+    hit_rate = _match_cache.hits / lookups if lookups else 0
+    return "Name lookup cache: {} hits, {} misses ({:.0%} hit rate), {}/{} entries".format(_match_cache.hits,
+                                                                                          _match_cache.misses,
+                                                                                          hit_rate,
+                                                                                          len(_match_cache.entries),
+                                                                                          _match_cache.size)
+
+
+def check_threshold(name: str, found_brother: Brother, score: float, threshold: Optional[float]) -> Brother:
+    """
+    Checks that a fuzzy match for name is good enough to use.
+
+    :raises BrotherNotFound: If threshold provided and not met
+    :return: found_brother
+    """
     if (not threshold) or score > threshold:
         return found_brother
     else:
@@ -108,4 +393,58 @@ async def find_by_name(name: str, threshold: Optional[float] = None) -> Brother:
         raise BrotherNotFound(msg)
 
 
+async def resolve_many(names: List[str], threshold: Optional[float] = None) -> List[Tuple[Optional[Brother], int]]:
+    """
+    Looks up many brothers by name at once. Much faster than calling find_by_name for each.
+    Exact and previously seen names are answered as find_by_name would. The rest are fuzzy searched in one batch.
+
+    :param names: The names to look up, with a fuzzy search
+    :param threshold: Minimum match ratio to accept. Can be none.
+    :return: For each name, the best-match brother (or None, if threshold provided and not met) and the match ratio
+    """
+    registry = _registry
+    found: List[Optional[Tuple[Brother, int]]] = [None] * len(names)
+
+    # Answer what we can without a search. Note where each unanswered name is wanted
+    misses: Dict[str, List[int]] = {}
+    for i, name in enumerate(names):
+        exact = find_by_exact_name(name)
+        if exact is not None:
+            found[i] = exact, 100
+        else:
+            normalised = normalise_name(name)
+            found[i] = _match_cache.get(normalised)
+            if found[i] is None:
+                misses.setdefault(normalised, []).append(i)
+
+    # Search for the rest all at once, remembering them for next time
+    for (normalised, positions), (found_index, score) in zip(misses.items(),
+                                                             registry.name_index.best_matches(list(misses))):
+        result = registry.brothers[found_index], score
+        _match_cache.put(normalised, result)
+        for i in positions:
+            found[i] = result
+
+    # Apply the threshold
+    results = []
+    for found_brother, score in found:
+        if threshold and score <= threshold:
+            found_brother = None
+        results.append((found_brother, score))
+    return results
+
+
+async def find_by_name(name: str, threshold: Optional[float] = None) -> Brother:
+    """
+    Looks up a brother by name. Raises exception if threshold provided and not met.
+
+    :param threshold: Minimum match ratio to accept. Can be none.
+    :param name: The name to look up, with a fuzzy search
+    :raises BrotherNotFound:
+    :return: The best-match brother
+    """
+    found_brother, score = await find_by_name_scored(name)
+    return check_threshold(name, found_brother, score, threshold)
+
+
 scroll_hook = hooks.ChannelHook(scroll_callback, patterns=r"scroll\s+(.*)")
@@ -1,15 +1,34 @@
 import re
 import textwrap
-from typing import Match
+from typing import Match, Dict
 
 import hooks
-from plugins import house_management
+from plugins import house_management, towel_ledger
 import client
 import slack_util
 from plugins.scroll_util import Brother
 
 counted_data = ["flaked", "rolled", "replaced", "washed", "dried"]
-lookup_format = "{}\s+(\d+)"
+
+# How many brothers to show on the leaderboard
+LEADERBOARD_SIZE = 10
+
+# Finds every "<verb> <count>" in a message, in one pass
+work_pattern = re.compile(r"({})\s+(\d+)".format("|".join(counted_data)))
+
+# A lone number, as if someone tried to record work without using one of the verbs
+unrecognized_work_pattern = re.compile(r"\s\d\s")
+
+
+def parse_work(text: str) -> Dict[str, int]:
+    """
+    Finds how much of each kind of work a (lowercased) message records.
+    Only the first count given for each kind is used.
+    """
+    new_work = {}
+    for match in work_pattern.finditer(text):
+        new_work.setdefault(match.group(1), int(match.group(2)))
+    return new_work
 
 
 def fmt_work_dict(work_dict: dict) -> str:
@@ -33,29 +52,24 @@ async def count_work_callback(event: slack_util.Event, match: Match) -> None:
     text = event.message.text.strip().lower()
 
     # Couple things to work through.
-    # One: Who sent the message?
-    who_wrote = await verb(event.user.as_user().get_brother())
-    who_wrote_label = "{} [{}]".format(who_wrote.name, who_wrote.scroll)
-
-    # Two: What work did they do?
-    new_work = {}
-    for job in counted_data:
-        pattern = lookup_format.format(job)
-        match = re.search(pattern, text)
-        if match:
-            new_work[job] = int(match.group(1))
+    # One: What work did they do?
+    new_work = parse_work(text)
 
-    # Three: check if we found anything
+    # Two: check if we found anything. Most messages are just chatter, so do this before looking anyone up
     if len(new_work) == 0:
-        if re.search(r'\s\d\s', text) is not None:
+        if unrecognized_work_pattern.search(text) is not None:
             client.get_slack().reply(event,
                                      "If you were trying to record work, it was not recognized.\n"
                                      "Use words {} or work will not be recorded".format(counted_data))
         return
 
+    # Three: Who sent the message?
+    who_wrote = await verb(event.user.as_user().get_brother())
+    who_wrote_label = "{} [{}]".format(who_wrote.name, who_wrote.scroll)
+
     # Four: Knowing they did something, record to total work
     contribution_count = sum(new_work.values())
-    new_total = await verb(record_towel_contribution(who_wrote, contribution_count))
+    new_total = await verb(record_towel_contribution(who_wrote, new_work))
 
     # Five, congratulate them on their work!
     congrats = textwrap.dedent("""{} recorded work:
@@ -68,34 +82,61 @@ async def count_work_callback(event: slack_util.Event, match: Match) -> None:
     client.get_slack().reply(event, congrats)
 
 
-async def record_towel_contribution(for_brother: Brother, contribution_count: int) -> int:
+async def record_towel_contribution(for_brother: Brother, new_work: Dict[str, int]) -> int:
     """
-    Grants <count> contribution point to the specified user.
+    Grants the specified user a contribution point for each piece of work, and logs the work in the towel ledger.
     Returns the new total.
     """
+    # Get the ledger first. If it has never been loaded, it seeds itself from the points as they were before this
+    ledger = await towel_ledger.get_ledger()
+
     # Import house points
-    headers, points = await house_management.import_points()
+    points = await house_management.import_points()
+
+    # Find the brother, and mog with more points. If not found, get mad!
+    new_total = points.add_towel_contributions(for_brother, sum(new_work.values()))
 
-    # Find the brother
-    for p in points:
-        if p is None or p.brother != for_brother:
-            continue
+    # Export
+    house_management.export_points(points)
 
-        # If found, mog with more points
-        p.towel_contribution_count += contribution_count
+    # Keep the leaderboard up to date
+    ledger.record(for_brother, new_work)
 
-        # Export
-        house_management.export_points(headers, points)
+    # Return the new total
+    return new_total
 
-        # Return the new total
-        return p.towel_contribution_count
 
-    # If not found, get mad!
-    raise KeyError("No score entry found for brother {}".format(for_brother))
+async def leaderboard_callback(event: slack_util.Event, match: Match) -> None:
+    ledger = await towel_ledger.get_ledger()
 
+    # Which ranking do they want?
+    kind = match.group(1)
+    kind = kind.lower() if kind else None
+    try:
+        ranking = ledger.ranking(kind)
+    except KeyError:
+        client.get_slack().reply(event, "Nobody has {} anything since the last reset. Try one of {}".format(
+            kind, ledger.verbs()))
+        return
 
-# Make dem HOOKs
+    if not ranking:
+        client.get_slack().reply(event, "No towel work recorded since the last reset")
+        return
+
+    lines = ["{}. {} [{}]: {}".format(place, name, scroll, count)
+             for place, ((scroll, name), count) in enumerate(ranking[:LEADERBOARD_SIZE], 1)]
+    client.get_slack().reply(event, "Towel leaderboard{} since the last reset:\n{}".format(
+        " for " + kind if kind else "", "\n".join(lines)))
+
+
+# Make dem HOOKs. Anything recording work has a number in it, so don't even bother with messages that don't
 count_work_hook = hooks.ChannelHook(count_work_callback,
-                                    patterns=".*",
+                                    patterns=r"\D*\d",
                                     channel_whitelist=["#slavestothemachine"],
                                     consumer=False)
+
+leaderboard_hook = hooks.ChannelHook(leaderboard_callback,
+                                     patterns=[
+                                         r"leaderboard(?:\s+(\w+))?",
+                                         r"towel stats(?:\s+(\w+))?",
+                                     ])
@@ -0,0 +1,119 @@
+"""
+Keeps every towel contribution in memory, so towel standings can be answered without touching the sheet.
+
+The ledger is append only, and written through to the house store. Contributions are grouped into periods, which
+start over whenever points are reset. Totals for the current period are kept per brother and per verb, and rankings
+are sorted on first request after each change.
+"""
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from plugins import house_management, house_store, scroll_util
+
+# The verb given to contributions carried over from the sheet, from before the ledger existed
+SEED_VERB = "seed"
+
+# (scroll, name). Brothers are interned, but only for as long as the bot runs. Entries are kept in the house store
+# across restarts, so key on what they store instead
+BrotherKey = Tuple[int, str]
+
+# (period, scroll, name, verb, count)
+Entry = Tuple[int, int, str, str, int]
+
+
+class TowelLedger(object):
+    """
+    Every towel contribution ever recorded, indexed by brother and by verb for the current period.
+    """
+
+    def __init__(self, entries: List[Entry], period: int):
+        self.entries = entries
+        self.period = period
+
+        # Current period totals
+        self.by_brother: Dict[BrotherKey, int] = {}
+        self.by_verb: Dict[str, Dict[BrotherKey, int]] = {}
+
+        # Sorted rankings, keyed by verb (None for all verbs). Cleared on every change
+        self.rankings: Dict[Optional[str], List[Tuple[BrotherKey, int]]] = {}
+
+        for entry in entries:
+            if entry[0] == period:
+                self._index(entry)
+
+    def _index(self, entry: Entry) -> None:
+        _, scroll, name, verb, count = entry
+        key = (scroll, name)
+        self.by_brother[key] = self.by_brother.get(key, 0) + count
+        verb_totals = self.by_verb.setdefault(verb, {})
+        verb_totals[key] = verb_totals.get(key, 0) + count
+        self.rankings.clear()
+
+    def record(self, brother: scroll_util.Brother, work: Dict[str, int]) -> None:
+        """
+        Appends a brothers contributions, given as verb -> count, to the ledger.
+        """
+        new_entries = [(self.period, brother.scroll, brother.name, verb, count) for verb, count in work.items()]
+        house_store.append_towel_entries(new_entries)
+        for entry in new_entries:
+            self.entries.append(entry)
+            self._index(entry)
+
+    def start_period(self) -> None:
+        """
+        Starts counting afresh, as when points are reset. Past entries are kept.
+        """
+        self.period += 1
+        house_store.set_towel_period(self.period)
+        self.by_brother.clear()
+        self.by_verb.clear()
+        self.rankings.clear()
+
+    def verbs(self) -> List[str]:
+        return sorted(self.by_verb)
+
+    def ranking(self, verb: Optional[str] = None) -> List[Tuple[BrotherKey, int]]:
+        """
+        Gets (brother, count) for the current period, most contributions first.
+        If a verb is given, only counts contributions of that kind.
+        :raises KeyError: If nobody has contributed with that verb this period
+        """
+        ranked = self.rankings.get(verb)
+        if ranked is None:
+            totals = self.by_brother if verb is None else self.by_verb[verb]
+            ranked = sorted(totals.items(), key=lambda kv: (-kv[1], kv[0][1]))
+            self.rankings[verb] = ranked
+        return ranked
+
+
+_ledger: Optional[TowelLedger] = None
+_ledger_lock = asyncio.Lock()
+
+
+async def _seed_from_points() -> None:
+    """
+    Starts the ledger off with everyone's towel contributions from the point sheet, so that standings are right for
+    the period already underway.
+    """
+    points = await house_management.import_points()
+    seeds = []
+    for brother in set(b for b in points.brothers if b is not None):
+        count = points.towel_contribution_count(brother)
+        if count:
+            seeds.append((0, brother.scroll, brother.name, SEED_VERB, count))
+    house_store.append_towel_entries(seeds)
+    house_store.set_towel_period(0)
+
+
+async def get_ledger() -> TowelLedger:
+    """
+    Gets the ledger, loading it on first use. The very first time, it is seeded from the point sheet.
+    Loaded at startup by periodicals.LoadTowelLedger, so commands shouldn't have to wait on this.
+    """
+    global _ledger
+    async with _ledger_lock:
+        if _ledger is None:
+            if house_store.get_towel_period() is None:
+                await _seed_from_points()
+            _ledger = TowelLedger(house_store.load_towel_entries(), house_store.get_towel_period())
+    return _ledger
@@ -0,0 +1,306 @@
+"""
+Records every raw payload slack sends us, so that real traffic can be replayed later, say for benchmarking.
+
+Each record is one line of JSON: when it was received, whether it came over the rtm connection or as an http
+interaction, and the payload itself. Records are handed to a background thread, which writes them out compressed,
+starting a new segment file once the current one gets big or old. Segments are compressed with zstd if the
+zstandard package is installed, and gzip otherwise.
+
+Turned on by settings.RECORD_EVENTS.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import gzip
+import io
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Iterable, Iterator, List, Optional
+
+import settings
+import slack_util
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# What reading a segment cut off mid-write (say, by a crash) can raise, depending on its compression
+_TRUNCATION_ERRORS = (EOFError, ValueError, gzip.BadGzipFile, zlib.error)
+if zstandard is not None:
+    _TRUNCATION_ERRORS += (zstandard.ZstdError,)
+
+# Record kinds
+RTM = "rtm"
+HTTP = "http"
+
+# How often the writer flushes what it has written to disk, in seconds
+FLUSH_INTERVAL = 5
+
+
+@dataclass
+class Record(object):
+    received: float  # Unix time
+    kind: str  # RTM or HTTP
+    payload: dict
+
+    def to_events(self) -> List[slack_util.Event]:
+        """
+        Converts the payload to events, just as the bot did when it was received.
+        """
+        if self.kind == RTM:
+            return [slack_util.message_dict_to_event(self.payload)]
+        elif self.kind == HTTP:
+            return slack_util.interaction_payload_to_events(self.payload)
+        raise ValueError("Unknown record kind {}".format(self.kind))
+
+
+class _ZstdReader(io.RawIOBase):
+    """
+    Decompresses a zstd file as it is read. Unlike zstandard's own stream reader, which quietly stops, a file cut off
+    mid-frame raises EOFError once everything before the cut has been read, as gzip does.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+        self.pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.pending:
+            chunk = self.file.read(io.DEFAULT_BUFFER_SIZE)
+            if not chunk:
+                if not self.decompressor.eof:
+                    raise EOFError("Compressed file ended before the end of the zstd frame")
+                return 0
+            self.pending = self.decompressor.decompress(chunk)
+
+        count = min(len(buffer), len(self.pending))
+        buffer[:count] = self.pending[:count]
+        self.pending = self.pending[count:]
+        return count
+
+    def close(self) -> None:
+        self.file.close()
+        super().close()
+
+
+def _open_segment(path: str, mode: str) -> io.TextIOBase:
+    """
+    Opens a segment file as text, compressed according to its extension.
+    """
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("Can't open {} without the zstandard package".format(path))
+        if "w" in mode:
+            raw = zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True)
+        else:
+            raw = io.BufferedReader(_ZstdReader(path))
+        return io.TextIOWrapper(raw, encoding="utf-8")
+    elif path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Recorder(object):
+    """
+    Queues up records, and writes them to rotating compressed segments from a background thread.
+    Safe to record from any thread.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 segment_bytes: int,
+                 segment_seconds: float,
+                 max_queued: int):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.extension = ".jsonl.zst" if zstandard is not None else ".jsonl.gz"
+
+        # Lines waiting to be written. Bounded, so a stuck disk can't eat all our memory
+        self.pending: queue.Queue = queue.Queue(max_queued)
+        self.dropped = 0
+
+        self.writer: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.writer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.writer = threading.Thread(target=self._write_forever, name="event-recorder", daemon=True)
+            self.writer.start()
+
+    def close(self) -> None:
+        """
+        Writes out everything queued so far, and closes the current segment. Recording stops.
+        """
+        if self.writer is not None:
+            self.pending.put(None)
+            self.writer.join()
+            self.writer = None
+
+    def record(self, kind: str, payload: dict) -> None:
+        """
+        Queues a payload to be recorded. Never blocks. If the writer has fallen too far behind, the record is dropped.
+        """
+        line = json.dumps({"received": time.time(), "kind": kind, "payload": payload}, separators=(",", ":"))
+        try:
+            self.pending.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def _new_segment_path(self) -> str:
+        name = "events-{}{}".format(datetime.now().strftime("%Y%m%d-%H%M%S-%f"), self.extension)
+        return os.path.join(self.directory, name)
+
+    def _write_forever(self) -> None:
+        segment = None
+        segment_bytes = 0
+        segment_started = 0.0
+        flushed = time.monotonic()
+        try:
+            while True:
+                # Wait for a record, but not past when the next flush is due
+                try:
+                    line = self.pending.get(timeout=max(flushed + FLUSH_INTERVAL - time.monotonic(), 0))
+                except queue.Empty:
+                    line = ""
+
+                # Told to stop
+                if line is None:
+                    return
+
+                try:
+                    if line:
+                        # Start a new segment if this one is full or old
+                        if segment is not None and (segment_bytes >= self.segment_bytes or
+                                                    time.monotonic() - segment_started >= self.segment_seconds):
+                            _close_segment(segment)
+                            segment = None
+                        if segment is None:
+                            segment = _open_segment(self._new_segment_path(), "w")
+                            segment_bytes = 0
+                            segment_started = time.monotonic()
+
+                        segment.write(line + "\n")
+                        segment_bytes += len(line) + 1
+
+                    # Get what we have so far onto disk every so often, however busy or quiet it is
+                    if time.monotonic() - flushed >= FLUSH_INTERVAL:
+                        flushed = time.monotonic()
+                        if segment is not None:
+                            segment.flush()
+                except Exception:
+                    # Recording is a nice to have. Don't let it take anything else down. Start a fresh segment
+                    logging.exception("Failed to write recorded event")
+                    if segment is not None:
+                        _close_segment(segment)
+                        segment = None
+        finally:
+            if segment is not None:
+                _close_segment(segment)
+
+
+def _close_segment(segment: io.TextIOBase) -> None:
+    """
+    Closes a segment, which finishes off its compressed stream.
+    """
+    try:
+        segment.close()
+    except Exception:
+        logging.exception("Failed to close recording segment")
+
+
+_recorder: Optional[Recorder] = None
+
+# Records come in from executor threads as well as the loop, so only let one of them make the recorder
+_recorder_lock = threading.Lock()
+
+
+def get_recorder() -> Optional[Recorder]:
+    """
+    Gets the recorder, starting it on first use. None if recording is turned off.
+    """
+    global _recorder
+    if _recorder is None and settings.RECORD_EVENTS:
+        with _recorder_lock:
+            if _recorder is None:
+                recorder = Recorder(settings.RECORD_DIRECTORY,
+                                    settings.RECORD_SEGMENT_BYTES,
+                                    settings.RECORD_SEGMENT_SECONDS,
+                                    settings.RECORD_MAX_QUEUED)
+                recorder.start()
+                atexit.register(recorder.close)
+                _recorder = recorder
+    return _recorder
+
+
+def record(kind: str, payload: dict) -> None:
+    """
+    Records a payload, if recording is turned on.
+    """
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.record(kind, payload)
+
+
+"""
+Reading recordings back
+"""
+
+
+def read_records(paths: Iterable[str]) -> Iterator[Record]:
+    """
+    Reads the records in each segment, in order. Segments may be zstd or gzip compressed, or plain jsonl.
+    A segment cut off mid-record (say, by a crash) is read up to the break.
+    """
+    for path in paths:
+        with _open_segment(path, "r") as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        data = json.loads(line)
+                        yield Record(data["received"], data["kind"], data["payload"])
+            except _TRUNCATION_ERRORS as e:
+                logging.warning("Recording {} ends early ({}: {}). Read what there was".format(path,
+                                                                                        type(e).__name__,
+                                                                                        e))
+
+
+async def replay_events(records: Iterable[Record], speed: float = 1) -> AsyncIterator[slack_util.Event]:
+    """
+    Yields the events of each record, spaced out as they were received, sped up by the given factor.
+    A speed of 0 yields them all as fast as possible.
+    """
+    first_received = None
+    start = time.monotonic()
+    for r in records:
+        if speed:
+            if first_received is None:
+                first_received = r.received
+            delay = start + (r.received - first_received) / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        for event in r.to_events():
+            yield event
+
+
+async def replay_event_feed(event_queue: asyncio.Queue, paths: List[str], speed: float = 1) -> None:
+    """
+    Puts recorded events in the queue, as rtm_event_feed and http_event_feed do for live ones.
+    Give it to ClientWrapper.handle_events, to run the bot off a recording.
+    """
+    async for event in replay_events(read_records(paths), speed):
+        await event_queue.put(event)
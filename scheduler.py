@@ -0,0 +1,355 @@
+"""
+Runs timed jobs, such as reminders, off a single heap of due times.
+
+Jobs are either cron-style (at certain times of day/week), or simple intervals. Each job can have some random jitter
+added to its due times, so that jobs on the same timer don't all hit slack at once.
+When a job runs, the time is saved to disk. Jobs with a catch up window that were missed while the bot was down
+(say, for a reboot) are run once on startup, so long as they aren't too late.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import json
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Set, Tuple
+
+import hooks
+
+# Where we remember when each job last ran
+STATE_FILE = "scheduler_state.json"
+
+# A job's callback
+JobCallback = Callable[[], Coroutine[Any, Any, None]]
+
+
+# Where the current time comes from. The simulation harness swaps this for a virtual clock
+_clock: Callable[[], datetime] = datetime.now
+
+
+def now() -> datetime:
+    """
+    The current local time, as far as timed jobs are concerned.
+    """
+    return _clock()
+
+
+def set_clock(clock: Callable[[], datetime]) -> None:
+    global _clock
+    _clock = clock
+
+
+def seconds_until(target: datetime) -> float:
+    """
+    Seconds from now until target, or 0 if it has already passed.
+    """
+    return max((target - now()).total_seconds(), 0)
+
+
+class Schedule(object):
+    """
+    Decides when a job is due.
+    """
+
+    def next_after(self, after: datetime) -> datetime:
+        """
+        Gets the first time strictly after the given time that the job is due.
+        """
+        raise NotImplementedError()
+
+
+class Interval(Schedule):
+    """
+    Due every so many seconds.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def next_after(self, after: datetime) -> datetime:
+        return after + timedelta(seconds=self.seconds)
+
+    def __str__(self) -> str:
+        return "every {}s".format(self.seconds)
+
+
+class Cron(Schedule):
+    """
+    Due at the times matching a standard 5 field cron spec: "minute hour day-of-month month day-of-week".
+    Each field may be *, a number, a range a-b, a step */n or a-b/n, or a comma separated list of those.
+    Day of week is 0-6 starting Sunday (7 is also Sunday). As in cron, if both day fields are restricted,
+    a time matching either is due.
+    """
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        fields = spec.split()
+        if len(fields) != 5:
+            raise ValueError("Cron spec \"{}\" should have 5 fields".format(spec))
+
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            self._parse_field(f, low, high) for f, (low, high) in zip(fields, self.FIELD_RANGES)]
+
+        # Sunday can be either 0 or 7
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+
+        # Track which day fields are restricted, for the cron either/or rule
+        self.days_restricted = fields[2] != "*"
+        self.weekdays_restricted = fields[4] != "*"
+
+    @staticmethod
+    def _parse_field(spec: str, low: int, high: int) -> Set[int]:
+        values = set()
+        for part in spec.split(","):
+            # Split off the step, if any
+            part, _, step = part.partition("/")
+            step = int(step) if step else 1
+
+            # Figure out the range
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(x) for x in part.split("-"))
+            else:
+                start = int(part)
+                end = high if step != 1 else start
+
+            if not (low <= start <= end <= high) or step < 1:
+                raise ValueError("Invalid cron field \"{}\"".format(spec))
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, day: datetime) -> bool:
+        day_ok = day.day in self.days
+        weekday_ok = (day.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, after: datetime) -> datetime:
+        # Start at the next whole minute
+        t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+
+        # Skip forward a month/day/hour/minute at a time, as appropriate. Every valid spec matches within a few years
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError("Cron spec \"{}\" never matches".format(self.spec))
+
+    def __str__(self) -> str:
+        return "cron \"{}\"".format(self.spec)
+
+
+@dataclass
+class ScheduledJob(object):
+    """
+    A job known to the scheduler, along with how its runs have gone.
+    """
+    name: str
+    schedule: Schedule
+    callback: JobCallback
+    jitter: float  # Up to how many seconds to randomly delay each run by
+    catch_up: Optional[float]  # How late (in seconds) a missed run can be and still be run. None to never catch up
+    run_at_start: bool  # Whether to run as soon as the scheduler starts, as well as on schedule
+
+    # Metrics
+    runs: int = 0
+    failures: int = 0
+    total_duration: float = 0
+    max_duration: float = 0
+    last_duration: Optional[float] = None
+    last_run: Optional[datetime] = None
+    next_due: Optional[datetime] = None
+
+    def jittered(self, due: datetime) -> datetime:
+        return due + timedelta(seconds=random.uniform(0, self.jitter)) if self.jitter else due
+
+    def describe(self) -> str:
+        mean = self.total_duration / self.runs if self.runs else 0
+        return "{}: {} runs ({} failed), took {:.2f}s mean, {:.2f}s max, {:.2f}s last. Runs {}, next at {}".format(
+            self.name,
+            self.runs,
+            self.failures,
+            mean,
+            self.max_duration,
+            self.last_duration or 0,
+            self.schedule,
+            self.next_due.strftime("%a %H:%M:%S") if self.next_due else "-")
+
+
+class Scheduler(hooks.Passive):
+    """
+    Runs every registered job at its due times. Register as a passive to get it going.
+    """
+
+    def __init__(self, state_file: str = STATE_FILE):
+        self.state_file = state_file
+        self.jobs: Dict[str, ScheduledJob] = {}
+
+        # Entries are (due, sequence number, job name). The sequence number keeps ties in insertion order
+        self.heap: List[Tuple[datetime, int, str]] = []
+        self.sequence = 0
+
+        # Set whenever the heap changes, so the run loop can recheck what's next
+        self.changed: Optional[asyncio.Event] = None
+
+        # Job name -> its run in progress. Kept so that they aren't garbage collected mid-run
+        self.running: Dict[str, asyncio.Task] = {}
+
+    def add(self,
+            name: str,
+            schedule: Schedule,
+            callback: JobCallback,
+            jitter: float = 0,
+            catch_up: Optional[float] = None,
+            run_at_start: bool = False) -> None:
+        """
+        Registers a job. Jobs added after the scheduler starts are scheduled immediately.
+        """
+        if name in self.jobs:
+            raise ValueError("Job {} already scheduled".format(name))
+        self.jobs[name] = ScheduledJob(name, schedule, callback, jitter, catch_up, run_at_start)
+        if self.changed is not None:
+            self._schedule_first(self.jobs[name], self._load_state())
+
+    def describe(self) -> str:
+        """
+        Describes how every job is doing.
+        """
+        if not self.jobs:
+            return "No scheduled jobs"
+        return "\n".join(job.describe() for job in self.jobs.values())
+
+    def _push(self, job: ScheduledJob, due: datetime) -> None:
+        job.next_due = due
+        heapq.heappush(self.heap, (due, self.sequence, job.name))
+        self.sequence += 1
+        if self.changed is not None:
+            self.changed.set()
+
+    def _load_state(self) -> Dict[str, str]:
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logging.exception("Couldn't read scheduler state. Skipping catch up")
+            return {}
+
+    def _save_state(self) -> None:
+        state = {job.name: job.last_run.isoformat() for job in self.jobs.values() if job.last_run is not None}
+
+        # Write then rename, so a crash can't leave a half written file
+        temp_file = self.state_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_file, self.state_file)
+
+    def _schedule_first(self, job: ScheduledJob, state: Dict[str, str]) -> None:
+        """
+        Figures out when a job should first run, catching up on anything missed since it last ran.
+        """
+        current_time = now()
+        if job.name in state:
+            job.last_run = datetime.fromisoformat(state[job.name])
+
+        if job.run_at_start:
+            self._push(job, current_time)
+            return
+
+        # Check for a run we missed since it last ran, recently enough to still be worth doing.
+        # Several missed runs only get caught up once
+        if job.catch_up is not None and job.last_run is not None:
+            missed = job.schedule.next_after(max(job.last_run, current_time - timedelta(seconds=job.catch_up)))
+            if missed <= current_time:
+                logging.info("Catching up on job {}, missed at {}".format(job.name, missed))
+                self._push(job, current_time)
+                return
+
+        self._push(job, job.jittered(job.schedule.next_after(current_time)))
+
+    async def _run_job(self, job: ScheduledJob) -> None:
+        """
+        Runs a job once, recording how it went, then schedules its next run.
+        Runs of the same job never overlap, as the next isn't scheduled until this one is done.
+        """
+        job.last_run = now()
+        start = time.perf_counter()
+        try:
+            await job.callback()
+        except Exception:
+            job.failures += 1
+            logging.exception("Scheduled job {} failed".format(job.name))
+        duration = time.perf_counter() - start
+
+        # Record
+        job.runs += 1
+        job.total_duration += duration
+        job.max_duration = max(job.max_duration, duration)
+        job.last_duration = duration
+        logging.info("Scheduled job {} took {:.2f}s".format(job.name, duration))
+
+        try:
+            self._save_state()
+        except OSError:
+            logging.exception("Couldn't save scheduler state")
+
+        self._push(job, job.jittered(job.schedule.next_after(now())))
+
+    async def run(self) -> None:
+        # Start from scratch, in case this is a restart
+        self.changed = asyncio.Event()
+        self.heap = []
+        state = self._load_state()
+        for job in self.jobs.values():
+            # Runs that outlived the last go schedule their own next run when they finish
+            if job.name not in self.running:
+                self._schedule_first(job, state)
+
+        while True:
+            self.changed.clear()
+
+            # Sleep until the next job is due, or the heap changes
+            if self.heap:
+                delay = seconds_until(self.heap[0][0])
+            else:
+                delay = None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Something is due. Run it alongside everything else
+            _, _, name = heapq.heappop(self.heap)
+            job = self.jobs[name]
+            job.next_due = None
+            task = asyncio.create_task(self._run_job(job))
+            self.running[name] = task
+            task.add_done_callback(lambda _, name=name: self.running.pop(name, None))
+
+
+_global_scheduler = Scheduler()
+
+
+def get_scheduler() -> Scheduler:
+    return _global_scheduler
@@ -10,4 +10,20 @@ SINGLE_THREAD_TASKS = False
 # howver, these warnings are harmless, as regardless of if aa task is awaited it still does its job
 USE_ASYNC_DEBUG_MODE = False
 
-LOGFILE = "run.log"
\ No newline at end of file
+LOGFILE = "run.log"
+
+# How many DMs to send at once when messaging lots of people, e.g. for reminders
+DM_CONCURRENCY = 8
+
+# Whether to record every raw event slack sends us, for replaying later. See recorder.py
+RECORD_EVENTS = False
+
+# Where recordings go
+RECORD_DIRECTORY = "recordings"
+
+# Start a new recording segment after this many (uncompressed) bytes, or this many seconds, whichever comes first
+RECORD_SEGMENT_BYTES = 64 * 1024 * 1024
+RECORD_SEGMENT_SECONDS = 60 * 60
+
+# How many events can be waiting to be written before we start dropping them
+RECORD_MAX_QUEUED = 10000
@@ -4,7 +4,7 @@ import logging
 from dataclasses import dataclass
 from pprint import pformat
 from time import sleep
-from typing import Optional, Generator, Callable, Union, Awaitable
+from typing import Optional, Generator, Callable, Union, Awaitable, List
 from typing import TypeVar
 
 from slackclient import SlackClient
@@ -140,9 +140,9 @@ Objects for interfacing easily with rtm steams, and handling async events
 """
 
 
-def message_stream(slack: SlackClient) -> Generator[Event, None, None]:
+def update_stream(slack: SlackClient) -> Generator[dict, None, None]:
     """
-    Generator that yields messages from slack.
+    Generator that yields raw updates from slack.
     Messages are in standard api format, look it up.
     Checks on 2 second intervals (may be changed)
     """
@@ -159,7 +159,7 @@ def message_stream(slack: SlackClient) -> Generator[Event, None, None]:
                     for update in update_list:
                         logging.info("RTM Message received")
                         logging.debug(pformat(update))
-                        yield message_dict_to_event(update)
+                        yield update
 
         except (SlackNotConnected, OSError) as e:
             logging.exception("Error while reading messages.")
@@ -197,6 +197,34 @@ def message_dict_to_event(update: dict) -> Event:
     return event
 
 
+def interaction_payload_to_events(payload: dict) -> List[Event]:
+    """
+    Converts an http interaction payload (say, from a button click) to events, one per action.
+    """
+    events = []
+    for action in payload.get("actions", []):
+        # Start building the event
+        ev = Event()
+
+        # Get the user who clicked the button
+        ev.user = UserContext(payload["user"]["id"])
+
+        # Get the message that they clicked
+        ev.message = RelatedMessageContext(payload["message"]["ts"], payload["message"]["text"])
+
+        # Get the channel it was clicked in
+        ev.conversation = ConversationContext(payload["channel"]["id"])
+
+        # Get the message this button/action was attached to
+        ev.interaction = InteractionContext(payload["response_url"],
+                                            payload["trigger_id"],
+                                            action["block_id"],
+                                            action["action_id"],
+                                            action.get("value"))
+        events.append(ev)
+    return events
+
+
 """
 Methods for easily responding to messages, etc.
 """
@@ -0,0 +1,17 @@
+"""
+Small helpers for the local sqlite databases the bot keeps.
+"""
+
+import sqlite3
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Opens a sqlite database in WAL mode, so readers don't block behind writers.
+    The connection may be shared between the event loop and executor threads,
+    so callers are responsible for serialising writes themselves.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,110 @@
+"""
+Tests for the three way merge that keeps the house store and the sheet in sync.
+"""
+
+import pytest
+
+import google_api
+from harness import fakes
+from plugins import house_store
+
+JOB = ["Kitchen", "Main", "Monday", "Richard Brodeur", "E-SIGNOFF", "n", "n"]
+BATH = ["Bath", "Main", "Tuesday", "Warren Bentley", "E-SIGNOFF", "n", "n"]
+SIGNED_BATH = ["Bath", "Main", "Tuesday", "Warren Bentley", "Richard Brodeur", "n", "n"]
+LATE_BATH = ["Bath", "Main", "Tuesday", "Warren Bentley", "E-SIGNOFF", "y", "n"]
+
+
+@pytest.fixture
+def sheets(tmp_path, monkeypatch):
+    """
+    A fresh store, mirrored to a fake sheet holding two jobs.
+    """
+    monkeypatch.setattr(house_store, "DB_PATH", str(tmp_path / "house_store.sqlite"))
+    monkeypatch.setattr(house_store, "_db", None)
+    service = fakes.FakeSheetsService({house_store.job_range: [list(JOB), list(BATH)],
+                                       house_store.point_range: [house_store.POINT_FIELDS]})
+    google_api.set_sheet_service(service)
+    yield service
+    google_api.set_sheet_service(None)
+
+
+def local_rows():
+    with house_store._db_lock:
+        return house_store._read_rows(house_store._assignment_table)
+
+
+def test_merge_takes_remote_when_local_unchanged():
+    merged, conflicts = house_store._merge([JOB, BATH], [JOB, BATH], [JOB, SIGNED_BATH])
+    assert merged == [JOB, SIGNED_BATH]
+    assert conflicts == 0
+
+
+def test_merge_keeps_local_when_remote_unchanged():
+    merged, conflicts = house_store._merge([JOB, BATH], [JOB, SIGNED_BATH], [JOB, BATH])
+    assert merged == [JOB, SIGNED_BATH]
+    assert conflicts == 0
+
+
+def test_merge_prefers_local_on_conflict():
+    merged, conflicts = house_store._merge([JOB, BATH], [JOB, SIGNED_BATH], [JOB, LATE_BATH])
+    assert merged == [JOB, SIGNED_BATH]
+    assert conflicts == 1
+
+
+def test_merge_agreeing_edits_are_not_conflicts():
+    merged, conflicts = house_store._merge([JOB, BATH], [JOB, SIGNED_BATH], [JOB, SIGNED_BATH])
+    assert merged == [JOB, SIGNED_BATH]
+    assert conflicts == 0
+
+
+def test_merge_handles_rows_added_and_removed():
+    # A row appended on the sheet, and one deleted locally
+    merged, conflicts = house_store._merge([JOB, BATH], [None, BATH], [JOB, BATH, LATE_BATH])
+    assert merged == [None, BATH, LATE_BATH]
+    assert conflicts == 0
+
+
+def test_first_sync_seeds_from_sheet(sheets):
+    assert house_store._sync_table(house_store._assignment_table)
+    assert local_rows() == [JOB, BATH]
+
+
+def test_sync_pulls_sheet_edits(sheets):
+    house_store._sync_table(house_store._assignment_table)
+    sheets.ranges[house_store.job_range][1] = list(SIGNED_BATH)
+
+    assert house_store._sync_table(house_store._assignment_table)
+    assert local_rows() == [JOB, SIGNED_BATH]
+
+
+def test_sync_pushes_local_edits(sheets):
+    house_store._sync_table(house_store._assignment_table)
+    house_store.save_assignment_rows([JOB, SIGNED_BATH])
+
+    assert not house_store._sync_table(house_store._assignment_table)
+    assert sheets.ranges[house_store.job_range] == [JOB, SIGNED_BATH]
+
+
+def test_sync_pushes_deleted_rows_as_blank(sheets):
+    house_store._sync_table(house_store._assignment_table)
+    house_store.save_assignment_rows([None, BATH])
+
+    house_store._sync_table(house_store._assignment_table)
+    assert sheets.ranges[house_store.job_range] == [[], BATH]
+
+    # Reading the blanked row back doesn't bring it back to life
+    assert not house_store._sync_table(house_store._assignment_table)
+    assert local_rows() == [None, BATH]
+
+
+def test_sync_skips_degraded_sheet(sheets, monkeypatch):
+    house_store._sync_table(house_store._assignment_table)
+    house_store.save_assignment_rows([JOB, SIGNED_BATH])
+
+    # Sheets is down, but we have an old copy cached. It mustn't be merged in as if it were current
+    def unavailable(*args, **kwargs):
+        raise google_api.SheetsUnavailable("down")
+    monkeypatch.setattr(google_api, "_call_with_retry", unavailable)
+    with pytest.raises(google_api.SheetsUnavailable):
+        house_store._sync_table(house_store._assignment_table)
+    assert local_rows() == [JOB, SIGNED_BATH]
@@ -0,0 +1,75 @@
+"""
+Tests for parsing cron specs, and working out when they are next due.
+"""
+
+from datetime import datetime
+
+import pytest
+
+from scheduler import Cron
+
+
+def test_next_after_is_strictly_after():
+    cron = Cron("0 10 * * *")
+    assert cron.next_after(datetime(2026, 10, 1, 9, 59, 30)) == datetime(2026, 10, 1, 10, 0)
+    assert cron.next_after(datetime(2026, 10, 1, 10, 0)) == datetime(2026, 10, 2, 10, 0)
+
+
+def test_steps_ranges_and_lists():
+    cron = Cron("*/15 9-10,22 * * *")
+    assert cron.minutes == {0, 15, 30, 45}
+    assert cron.hours == {9, 10, 22}
+    assert cron.next_after(datetime(2026, 10, 1, 10, 50)) == datetime(2026, 10, 1, 22, 0)
+
+
+def test_either_day_field_matches_when_both_restricted():
+    # The 13th, or any Friday
+    cron = Cron("0 9 13 * 5")
+
+    # Thursday the 1st -> Friday the 2nd
+    assert cron.next_after(datetime(2026, 10, 1, 12, 0)) == datetime(2026, 10, 2, 9, 0)
+
+    # Monday the 12th -> Tuesday the 13th, which isn't a Friday
+    assert cron.next_after(datetime(2026, 10, 12, 12, 0)) == datetime(2026, 10, 13, 9, 0)
+
+
+def test_both_day_fields_must_match_when_one_is_unrestricted():
+    # Fridays only. Not every day, just because the day of month is *
+    cron = Cron("0 9 * * 5")
+    assert cron.next_after(datetime(2026, 10, 3, 12, 0)) == datetime(2026, 10, 9, 9, 0)
+
+
+def test_seven_is_sunday():
+    assert Cron("0 0 * * 7").weekdays == {0}
+    assert Cron("0 0 * * 0").weekdays == {0}
+
+    # Thursday the 1st -> Sunday the 4th
+    assert Cron("30 8 * * 7").next_after(datetime(2026, 10, 1)) == datetime(2026, 10, 4, 8, 30)
+
+
+def test_rolls_over_month_and_year():
+    # Last minute of January -> the 1st of February
+    assert Cron("0 0 1 * *").next_after(datetime(2026, 1, 31, 23, 59)) == datetime(2026, 2, 1, 0, 0)
+
+    # The 31st skips months without one
+    assert Cron("0 12 31 * *").next_after(datetime(2026, 1, 31, 13, 0)) == datetime(2026, 3, 31, 12, 0)
+
+    # Into the next year
+    assert Cron("0 0 1 1 *").next_after(datetime(2026, 6, 1)) == datetime(2027, 1, 1, 0, 0)
+
+
+def test_leap_day():
+    assert Cron("0 0 29 2 *").next_after(datetime(2026, 3, 1)) == datetime(2028, 2, 29, 0, 0)
+
+
+def test_never_matches():
+    cron = Cron("0 0 31 2 *")
+    with pytest.raises(ValueError, match="never matches"):
+        cron.next_after(datetime(2026, 1, 1))
+
+
+@pytest.mark.parametrize("spec", ["* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * 13 *", "* * * * 8",
+                                  "5-1 * * * *", "*/0 * * * *"])
+def test_invalid_specs(spec):
+    with pytest.raises(ValueError):
+        Cron(spec)